@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable
+
+from owarida.processors import get_processor
+from owarida.utils import get_record_rng, get_templates, select_template
+
+# Answer texts for the synthetic records, so that they look roughly like the real ones.
+WORDS = ["water", "energy", "plant", "the sun", "a magnet", "gravity", "friction", "oxygen", "a rock", "the moon"]
+NAMES = ["John", "Mary", "Kevin", "Sarah", "the teacher", "the dog", "Lisa", "the car", "Bob", "the cake"]
+
+def make_arc_records(num_records: int, rng: random.Random) -> list[dict]:
+    '''
+    Makes ARC-shaped records with 3 to 5 answer choices, keyed by letters or (sometimes) by numbers.
+    '''
+    records = []
+    for idx in range(num_records):
+        num_choices = rng.choice([3, 4, 4, 4, 5])
+        labels = list("1234")[:num_choices] if num_choices <= 4 and rng.random() < 0.1 else list("ABCDE")[:num_choices]
+        records.append({
+            "id": f"synthetic_{idx}",
+            "question": f"Which of these is most likely to {rng.choice(['heat', 'move', 'change', 'absorb'])} {rng.choice(WORDS)} during an experiment number {idx}?",
+            "choices": {"text": [f"{rng.choice(WORDS)} ({idx}-{i})" for i in range(num_choices)], "label": labels},
+            "answerKey": rng.choice(labels),
+        })
+    return records
+
+def make_winogrande_records(num_records: int, rng: random.Random) -> list[dict]:
+    '''
+    Makes Winogrande-shaped records: a sentence with a blank and two options.
+    '''
+    records = []
+    for idx in range(num_records):
+        option1, option2 = rng.sample(NAMES, 2)
+        records.append({
+            "sentence": f"{option1} could not lift the box for {option2} because _ was too weak on day {idx}.",
+            "option1": option1,
+            "option2": option2,
+            "answer": rng.choice(["1", "2"]),
+        })
+    return records
+
+def stage_datasets(staging_dir: str, num_records: int) -> None:
+    '''
+    Saves the synthetic datasets to disk, so that the processors can load them with their local data source.
+    '''
+    from datasets import Dataset
+
+    rng = random.Random(0)
+    Dataset.from_list(make_arc_records(num_records, rng)).save_to_disk(os.path.join(staging_dir, 'arc_easy'))
+    Dataset.from_list(make_winogrande_records(num_records, rng)).save_to_disk(os.path.join(staging_dir, 'winogrande'))
+
+def run_benchmark(fn: Callable[[], int], min_time: float) -> dict:
+    '''
+    Runs a benchmark until at least `min_time` seconds have passed, then runs it once more under `tracemalloc`.
+    Args:
+        fn: The benchmark. Returns the number of rows it processed.
+        min_time: The minimum number of seconds to time the benchmark for.
+    Returns:
+        The throughput of the benchmark and the memory it allocated.
+    '''
+    rows = 0
+    runs = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time or runs == 0:
+        rows += fn()
+        runs += 1
+
+    # Allocations are measured separately, as tracing them slows everything down.
+    tracemalloc.start()
+    fn()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "rows": rows,
+        "runs": runs,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed,
+        "peak_alloc_bytes": peak_bytes,
+    }
+
+def run_suite(args: argparse.Namespace) -> list[dict]:
+    '''
+    Runs every benchmark on synthetic data.
+    Returns:
+        One result per benchmark, with its name and parameters.
+    '''
+    results = []
+    def record(name: str, params: dict, fn: Callable[[], int]) -> None:
+        result = {"name": name, "params": params, **run_benchmark(fn, args.min_time)}
+        print(f"{name:<16} {json.dumps(params):<70} {result['rows_per_sec']:>12,.0f} rows/s {result['peak_alloc_bytes'] / 1e6:>9.2f} MB peak", file=sys.stderr)
+        results.append(result)
+
+    with tempfile.TemporaryDirectory() as staging_dir:
+        stage_datasets(staging_dir, args.rows)
+        processors = {
+            dataset: get_processor(dataset, local_dir=os.path.join(staging_dir, dataset))
+            for dataset in ['arc_easy', 'winogrande']
+        }
+        for dataset, processor in processors.items():
+            processor.templates = get_templates(processor.templates_name)
+            processor.set_seed(0)
+            entries = processor.dataset.to_list()
+            # Every placeholder any of the templates may need.
+            values = {
+                placeholder: "text"
+                for template in processor.templates for placeholder in template.placeholders
+            }
+
+            def select_and_render() -> int:
+                rng = random.Random(0)
+                for _ in entries:
+                    select_template(processor.templates, rng).render(values, rng)
+                return len(entries)
+            record("select_template", {"dataset": dataset}, select_and_render)
+
+            def augment_one() -> int:
+                for idx, entry in enumerate(entries):
+                    processor._augment_one(entry, get_record_rng(0, dataset, 0, idx))
+                return len(entries)
+            record("augment_one", {"dataset": dataset}, augment_one)
+
+            rng = random.Random(0)
+            rendered = [select_template(processor.templates, rng).render(values, rng) for _ in entries]
+            def return_sharegpt() -> int:
+                for text in rendered:
+                    processor._return_sharegpt(text)
+                return len(rendered)
+            record("return_sharegpt", {"dataset": dataset}, return_sharegpt)
+
+            for num_iterations in args.iterations:
+                processor.set_num_iterations(num_iterations)
+                for batch_size in args.batch_sizes:
+                    batches = [
+                        (batch, list(range(start, start + len(batch[processor.dataset.column_names[0]]))))
+                        for start, batch in zip(range(0, len(processor.dataset), batch_size), processor.dataset.iter(batch_size=batch_size))
+                    ]
+                    def augment_batch() -> int:
+                        return sum(len(processor._augment_batch(batch, indices)["conversations"]) for batch, indices in batches)
+                    record("augment_batch", {"dataset": dataset, "num_iterations": num_iterations, "batch_size": batch_size}, augment_batch)
+
+                    for compression in args.compressions:
+                        output_dir = os.path.join(staging_dir, 'outputs', dataset)
+                        def write() -> int:
+                            processor.write(
+                                output_dir,
+                                batch_size=batch_size,
+                                resume=False,
+                                compression=compression if compression != 'none' else None
+                            )
+                            return len(processor.dataset) * num_iterations
+                        params = {"dataset": dataset, "num_iterations": num_iterations, "batch_size": batch_size, "compression": compression}
+                        record("write", params, write)
+
+    return results
+
+def get_git_commit() -> str:
+    '''
+    Returns the commit the benchmarks ran on, or an empty string outside of a git checkout.
+    '''
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    '''
+    Prints the change in throughput of every benchmark between two result files.
+    '''
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    with open(candidate_path, 'r') as file:
+        candidate = json.load(file)
+    key = lambda result: (result["name"], json.dumps(result["params"], sort_keys=True))
+    baseline_results = {key(result): result for result in baseline["results"]}
+    print(f"Baseline: {baseline['commit'][:12] or baseline_path}, candidate: {candidate['commit'][:12] or candidate_path}")
+    for result in candidate["results"]:
+        if (old_result := baseline_results.get(key(result))) is None:
+            continue
+        speedup = result["rows_per_sec"] / old_result["rows_per_sec"]
+        print(f"{result['name']:<16} {key(result)[1]:<70} {old_result['rows_per_sec']:>12,.0f} -> {result['rows_per_sec']:>12,.0f} rows/s ({speedup:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks template rendering, augmentation and writing on synthetic data.')
+    parser.add_argument('-r', "--rows", help='Number of synthetic rows per dataset. Default: 2000.', type=int, default=2000)
+    parser.add_argument('-n', "--iterations", help='Comma-separated numbers of iterations to benchmark batches and writing with. Default: 1,4.', default='1,4')
+    parser.add_argument('-b', "--batch-sizes", "--batch_sizes", dest='batch_sizes', help='Comma-separated batch sizes to benchmark. Default: 100,1000.', default='100,1000')
+    parser.add_argument('-c', "--compressions", help='Comma-separated compressions to benchmark writing with. Default: none,gzip.', default='none,gzip')
+    parser.add_argument('-t', "--min-time", "--min_time", dest='min_time', help='Minimum number of seconds to time every benchmark for. Default: 1.', type=float, default=1.0)
+    parser.add_argument('-o', "--output", help='File to write the results to as JSON. Default: stdout.', default=None)
+    parser.add_argument("--compare", help='Compare two result files (baseline, then candidate) instead of running the benchmarks.', nargs=2, metavar=('BASELINE', 'CANDIDATE'), default=None)
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+
+    args.iterations = [int(num_iterations) for num_iterations in args.iterations.split(',')]
+    args.batch_sizes = [int(batch_size) for batch_size in args.batch_sizes.split(',')]
+    args.compressions = args.compressions.split(',')
+    report = {
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "args": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        "results": run_suite(args),
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
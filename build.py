@@ -1,34 +1,435 @@
 import argparse
+import importlib.util
+import os
+import sys
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, Optional
 
 from tqdm import tqdm
 
-from owarida.processors import PROCESSOR_MAP
+from owarida.processors import PROCESSOR_MAP, get_processor
+from owarida.processors.base import DEFAULT_BATCH_SIZE, DEFAULT_SAMPLE_SIZE, DEFAULT_WRITE_QUEUE_SIZE, METADATA_COLUMNS, BaseProcessor
+from owarida.mixing import get_mix_counts, parse_mix, write_mix
+from owarida.utils import (
+    DATA_DIR,
+    DEFAULT_ROW_GROUP_SIZE,
+    OUTPUT_FORMATS,
+    OUTPUTS_DIR,
+    format_filesize,
+    get_free_bytes,
+    get_output_dir,
+    get_random_seed,
+    load_manifest,
+    merge_node_outputs,
+    prefetch,
+    verify_node_outputs
+)
+
+def parse_datasets(parser: argparse.ArgumentParser, datasets: str) -> list[str]:
+    '''
+    Parses the datasets given on the command line, and reports unknown datasets as a parser error.
+    Args:
+        parser: The command line parser, to report unknown datasets with.
+        datasets: The comma-separated names of the datasets, or 'all' for every dataset.
+    Returns:
+        The names of the datasets.
+    '''
+    datasets = datasets.split(',') if datasets != 'all' else list(PROCESSOR_MAP.keys())
+    check_datasets(parser, datasets)
+    return datasets
+
+def check_datasets(parser: argparse.ArgumentParser, datasets: Iterable[str]) -> None:
+    '''
+    Reports datasets which do not exist as a parser error.
+    Args:
+        parser: The command line parser, to report unknown datasets with.
+        datasets: The names of the datasets.
+    '''
+    if (unknown_datasets := [dataset for dataset in datasets if dataset not in PROCESSOR_MAP]):
+        parser.error(f"Unknown dataset(s): {', '.join(unknown_datasets)}. Valid datasets: {', '.join(PROCESSOR_MAP)}.")
+
+def get_local_dir(args: argparse.Namespace, dataset: str) -> Optional[str]:
+    '''
+    Returns the directory holding the local copy of a dataset, or None if the dataset is to be downloaded.
+    Args:
+        args: The parsed command line arguments.
+        dataset: The name of the dataset.
+    '''
+    return os.path.join(args.local, dataset) if args.local is not None else None
+
+def get_writer_kwargs(args: argparse.Namespace) -> dict:
+    '''
+    Returns the options to write the output with, as given on the command line.
+    Args:
+        args: The parsed command line arguments.
+    Returns:
+        The keyword arguments for `get_writer`.
+    '''
+    writer_kwargs = {
+        "output_format": args.output_format,
+        "compression_level": args.compression_level,
+        "max_rows": args.max_shard_rows,
+        "max_bytes": int(args.max_shard_mb * 1_000_000) if args.max_shard_mb is not None else None,
+    }
+    # Without --compression, every format uses its own default (zstd for Parquet, none otherwise).
+    if args.compression is not None:
+        writer_kwargs["compression"] = args.compression if args.compression != 'none' else None
+    if args.output_format != 'jsonl':
+        writer_kwargs["row_group_size"] = args.row_group_size
+    return writer_kwargs
+
+def get_dataset_seeds(datasets: list[str], seed: Optional[int], reuse: bool = True) -> dict[str, int]:
+    '''
+    Returns the seed to build every dataset with.
+    Without a seed, a dataset which has been built (or started) before keeps the seed recorded in its manifest,
+    so that a plain rerun skips or resumes it instead of starting over. Every other dataset gets a freshly drawn seed.
+    Args:
+        datasets: The names of the datasets.
+        seed: The seed given on the command line, or None if none was given.
+        reuse: Whether to reuse the seeds of previous builds. Set to False to draw a fresh seed for every dataset.
+    Returns:
+        The seed of every dataset.
+    '''
+    if seed is not None:
+        return {dataset: seed for dataset in datasets}
+    # Every dataset (and every process) shares the fresh seed, so draw it once up front.
+    new_seed = get_random_seed()
+    seeds = {}
+    for dataset in datasets:
+        manifest = load_manifest(get_output_dir(dataset)) if reuse else None
+        if manifest is not None and manifest["config"].get("seed") is not None:
+            seeds[dataset] = manifest["config"]["seed"]
+            print(f"Reusing seed {seeds[dataset]} of the previous build of dataset '{dataset}'.")
+        else:
+            seeds[dataset] = new_seed
+    if new_seed in seeds.values():
+        print(f"Using seed {new_seed}. Pass `--seed {new_seed}` to resume or reproduce this build.")
+    return seeds
+
+def load_processor(dataset: str, args: argparse.Namespace) -> BaseProcessor:
+    '''
+    Constructs the processor of a dataset, which loads (and if needed downloads) the dataset, and configures it.
+    Args:
+        dataset: The name of the dataset.
+        args: The parsed command line arguments.
+    Returns:
+        The processor.
+    '''
+    # Only the selected datasets get constructed, and thereby downloaded.
+    processor = get_processor(dataset, local_dir=get_local_dir(args, dataset))
+    processor.set_num_iterations(args.num_iterations)
+    processor.set_seed(args.seeds[dataset])
+    processor.set_shard(args.shard_index, args.num_shards)
+    return processor
+
+def load_processors(datasets: list[str], args: argparse.Namespace) -> Iterator[tuple[str, Optional[BaseProcessor], Optional[str]]]:
+    '''
+    Loads the processors of several datasets one after the other.
+    A dataset which fails to load is reported instead of stopping the datasets after it from being loaded.
+    Args:
+        datasets: The names of the datasets.
+        args: The parsed command line arguments.
+    Returns:
+        An iterator over the name of every dataset, along with its processor and None,
+        or with None and the traceback if it failed to load.
+    '''
+    for dataset in datasets:
+        try:
+            yield dataset, load_processor(dataset, args), None
+        except Exception:
+            yield dataset, None, traceback.format_exc()
+
+def write_dataset(processor: BaseProcessor, args: argparse.Namespace) -> Optional[str]:
+    '''
+    Augments a loaded dataset and writes it to disk, along with the metrics of the build.
+    Args:
+        processor: The processor of the dataset.
+        args: The parsed command line arguments.
+    Returns:
+        A summary of the metrics if it was asked for, otherwise None.
+    '''
+    processor.write(
+        batch_size=args.batch_size,
+        num_proc=args.num_proc,
+        resume=not args.force,
+        dedup=args.dedup if args.dedup != 'none' else None,
+        dedup_action=args.dedup_action,
+        metadata_columns=args.metadata_columns,
+        write_queue_size=args.write_queue,
+        **get_writer_kwargs(args)
+    )
+    return processor.metrics.summary(processor.templates) if args.metrics_summary else None
+
+def build_dataset(dataset: str, args: argparse.Namespace) -> Optional[str]:
+    '''
+    Augments a single dataset and writes it to disk, along with the metrics of the build.
+    Args:
+        dataset: The name of the dataset.
+        args: The parsed command line arguments.
+    Returns:
+        A summary of the metrics if it was asked for, otherwise None.
+    '''
+    return write_dataset(load_processor(dataset, args), args)
+
+def estimate_dataset(dataset: str, args: argparse.Namespace) -> dict:
+    '''
+    Estimates the output of building a single dataset from a sample of it, without building it.
+    Args:
+        dataset: The name of the dataset.
+        args: The parsed command line arguments.
+    Returns:
+        The estimate (see `BaseProcessor.estimate`).
+    '''
+    processor = load_processor(dataset, args)
+    writer_kwargs = get_writer_kwargs(args)
+    # Shard limits do not change the size of the output.
+    for key in ("max_rows", "max_bytes"):
+        writer_kwargs.pop(key)
+    return processor.estimate(args.dry_run_rows, metadata_columns=args.metadata_columns, **writer_kwargs)
+
+def dry_run(datasets: list[str], args: argparse.Namespace) -> None:
+    '''
+    Prints how many rows, how much storage and how much time building the datasets would take, and checks that
+    the output fits on the disk. Exits with an error if it does not.
+    Args:
+        datasets: The names of the datasets.
+        args: The parsed command line arguments.
+    '''
+    estimates = []
+    for dataset in tqdm(datasets, desc="Sampling datasets"):
+        estimates.append(estimate_dataset(dataset, args))
+    # Time scales with the number of processes at best, and datasets only overlap with --jobs.
+    num_proc = max(args.num_proc or 1, 1)
+    for estimate in estimates:
+        print(
+            f"{estimate['dataset']}: {estimate['entries']:,} entries -> {estimate['rows']:,} rows, "
+            f"~{format_filesize(estimate['bytes'])} of {args.output_format} output "
+            f"(source: {format_filesize(estimate['source_bytes'])}), ~{estimate['seconds'] / num_proc:,.1f}s "
+            f"(estimated from {estimate['sample_rows']:,} rows)"
+        )
+    total_rows = sum(estimate["rows"] for estimate in estimates)
+    total_bytes = sum(estimate["bytes"] for estimate in estimates)
+    total_seconds = sum(estimate["seconds"] for estimate in estimates) / num_proc / max(min(args.jobs, len(estimates)), 1)
+    free_bytes = get_free_bytes(OUTPUTS_DIR)
+    print(f"Total: {total_rows:,} rows, ~{format_filesize(total_bytes)}, ~{total_seconds:,.1f}s. Free space in {OUTPUTS_DIR}: {format_filesize(free_bytes)}.")
+    if total_bytes > free_bytes:
+        print(f"The output does not fit on the disk: {format_filesize(total_bytes - free_bytes)} short.")
+        sys.exit(1)
+
+def build_mix(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    '''
+    Augments several datasets at once and writes them, interleaved and shuffled, as a single output.
+    Args:
+        parser: The command line parser, to report invalid arguments with.
+        args: The parsed command line arguments.
+    '''
+    try:
+        counts = get_mix_counts(parse_mix(args.mix), args.mix_rows)
+    except ValueError as e:
+        parser.error(str(e))
+    check_datasets(parser, counts)
+    # Mixed rows are augmented on the fly (see `iter_augmented`), which does not keep the index of the source row.
+    if 'source_id' in args.metadata_columns:
+        parser.error("--mix cannot write the source_id metadata column.")
+
+    processors = {}
+    for dataset in tqdm(counts, desc="Loading datasets"):
+        processors[dataset] = get_processor(dataset, local_dir=get_local_dir(args, dataset))
+    output_dir = get_output_dir('mix')
+    num_rows = write_mix(
+        processors,
+        counts,
+        args.seed,
+        output_dir,
+        shuffle_buffer=args.shuffle_buffer,
+        columns=["conversations", "dataset", *args.metadata_columns],
+        **get_writer_kwargs(args)
+    )
+    mix_str = ", ".join(f"{count:,} from {dataset}" for dataset, count in counts.items())
+    print(f"Mixed {num_rows:,} rows ({mix_str}) and saved them to {output_dir}.")
+
+def serve(argv: list[str]) -> None:
+    '''
+    Runs the augmentation server, which hands out augmented batches over HTTP until interrupted.
+    Args:
+        argv: The command line arguments after `serve`.
+    '''
+    parser = argparse.ArgumentParser(prog='build.py serve', description='Serve augmented batches to trainers over HTTP.')
+    parser.add_argument('-d', "--datasets", help='List of datasets to serve, separated by commas. Default: all datasets.', default='all')
+    parser.add_argument('-l', "--local", help=f'Read pre-staged Arrow or Parquet files from <LOCAL>/<dataset> instead of downloading the datasets. Without a path, <LOCAL> is {DATA_DIR}.', nargs='?', const=DATA_DIR, default=None)
+    parser.add_argument("--host", help='Host to listen on. Default: 127.0.0.1.', default='127.0.0.1')
+    parser.add_argument("--port", help='Port to listen on. Default: 8765.', type=int, default=8765)
+    parser.add_argument("--max-clients", "--max_clients", dest='max_clients', help='Maximum number of requests to serve at the same time. Default: 8.', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    datasets = parse_datasets(parser, args.datasets)
+
+    from owarida.server import AugmentationServer
+    AugmentationServer(datasets, local_root=args.local, max_clients=args.max_clients).serve(args.host, args.port)
+
+def merge(argv: list[str]) -> None:
+    '''
+    Verifies the outputs which several machines built with `--num-shards` and merges them into one output per dataset.
+    Args:
+        argv: The command line arguments after `merge`.
+    '''
+    parser = argparse.ArgumentParser(prog='build.py merge', description='Verify and merge the outputs of a build split across several machines.')
+    parser.add_argument('-d', "--datasets", help='List of datasets to merge, separated by commas. Default: all datasets.', default='all')
+    parser.add_argument('-k', "--num-shards", "--num_shards", dest='num_shards', help='Number of machines the build was split across.', type=int, required=True)
+    parser.add_argument("--verify-only", "--verify_only", dest='verify_only', help='Only check that the outputs are complete and intact, without merging them.', action='store_true')
+    parser.add_argument("--keep-nodes", "--keep_nodes", dest='keep_nodes', help='Copy the shards and keep the output of every machine, instead of moving the shards.', action='store_true')
+    args = parser.parse_args(argv)
+
+    datasets = parse_datasets(parser, args.datasets)
+
+    failed_datasets = []
+    for dataset in datasets:
+        output_dir = get_output_dir(dataset)
+        if (problems := verify_node_outputs(output_dir, args.num_shards)):
+            print(f"Dataset '{dataset}' is incomplete:\n" + "\n".join(f"  {problem}" for problem in problems))
+            failed_datasets.append(dataset)
+            continue
+        if args.verify_only:
+            print(f"Dataset '{dataset}' is complete.")
+            continue
+        manifest = merge_node_outputs(output_dir, args.num_shards, keep_nodes=args.keep_nodes)
+        num_rows = sum(shard["rows"] for shard in manifest["shards"])
+        print(f"Merged {len(manifest['shards'])} shards ({num_rows:,} rows) of dataset '{dataset}' into {output_dir}.")
+    if failed_datasets:
+        sys.exit(1)
 
 def main():
-    parser = argparse.ArgumentParser()
+    if sys.argv[1:2] == ['serve']:
+        serve(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['merge']:
+        merge(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(epilog='Run `build.py serve --help` for serving augmented batches over HTTP instead, and `build.py merge --help` for merging builds split across several machines.')
     parser.add_argument('-d', "--datasets", help='List of datasets to augment, separated by commas. Default: all datasets.', default='all')
     parser.add_argument('-n', "--num_iterations", help='Number of times to run augmentations.', type=int, default=1)
+    parser.add_argument('-l', "--local", help=f'Read pre-staged Arrow or Parquet files from <LOCAL>/<dataset> instead of downloading the datasets. Without a path, <LOCAL> is {DATA_DIR}.', nargs='?', const=DATA_DIR, default=None)
+    parser.add_argument('-s', "--seed", help='Seed for the augmentations. The same seed always produces the same output. Default: the seed of the previous build of each dataset, so that it can be skipped or resumed, or else a random seed.', type=int, default=None)
+    parser.add_argument('-j', "--jobs", help='Number of datasets to build at the same time, each in its own process. Default: 1.', type=int, default=1)
+    parser.add_argument('-p', "--num-proc", "--num_proc", dest='num_proc', help='Number of processes to augment each dataset with. Default: augment in the current process.', type=int, default=None)
+    parser.add_argument('-b', "--batch-size", "--batch_size", dest='batch_size', help=f'Number of augmented rows to produce at once. Every source row makes --num_iterations of them. Default: {DEFAULT_BATCH_SIZE}.', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--prefetch", help='Number of datasets to load (and download) ahead, while the current dataset is being built. 0 loads every dataset only once it is its turn. Ignored with --jobs. Default: 1.', type=int, default=1)
+    parser.add_argument("--write-queue", "--write_queue", dest='write_queue', help=f'Number of augmented batches which can wait to be written, while the next batches are augmented. 0 writes every batch before augmenting the next one. Default: {DEFAULT_WRITE_QUEUE_SIZE}.', type=int, default=DEFAULT_WRITE_QUEUE_SIZE)
+    parser.add_argument('-o', "--output-format", "--output_format", dest='output_format', help='Format of the output shards. Default: jsonl.', choices=list(OUTPUT_FORMATS), default='jsonl')
+    parser.add_argument('-c', "--compression", help='Compression to use for the output shards. Arrow supports zstd only. Default: zstd for parquet, none otherwise.', choices=['none', 'gzip', 'zstd'], default=None)
+    parser.add_argument("--compression-level", "--compression_level", dest='compression_level', help='Compression level to use. Default: the default level of the compression scheme.', type=int, default=None)
+    parser.add_argument("--max-shard-rows", "--max_shard_rows", dest='max_shard_rows', help='Maximum number of rows per output shard. Default: no limit.', type=int, default=None)
+    parser.add_argument("--row-group-size", "--row_group_size", dest='row_group_size', help=f'Number of rows per Parquet row group or Arrow record batch. Default: {DEFAULT_ROW_GROUP_SIZE}.', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument("--metadata-columns", "--metadata_columns", dest='metadata_columns', help=f'Comma-separated columns to write along with the conversations, out of {", ".join(METADATA_COLUMNS)}, or "none". Default: iteration.', default='iteration')
+    parser.add_argument("--max-shard-mb", "--max_shard_mb", dest='max_shard_mb', help='Maximum size of an output shard on disk, in MB. For parquet and arrow, the size of the buffered rows is estimated, so shards can come out a few percent larger. Default: no limit.', type=float, default=None)
+    parser.add_argument("--dedup", help='Catch duplicate rows before they are written: exact repeats only (exact), or exact and near-identical ones (near). Default: none.', choices=['none', 'exact', 'near'], default='none')
+    parser.add_argument("--dedup-action", "--dedup_action", dest='dedup_action', help='What to do with duplicate rows: leave them out (drop) or draw them again (resample). Default: drop.', choices=['drop', 'resample'], default='drop')
+    parser.add_argument('-m', "--metrics-summary", "--metrics_summary", dest='metrics_summary', help='Print a summary of the metrics of every dataset. The full metrics are always written to metrics.json in the output directory.', action='store_true')
+    parser.add_argument("--mix", help='Write a single shuffled mix of datasets to owarida/outputs/mix instead of one output per dataset. Comma-separated datasets with weights, e.g. arc_easy:1,winogrande:3. Without --mix-rows, the weights are the number of rows to take from every dataset.', default=None)
+    parser.add_argument("--mix-rows", "--mix_rows", dest='mix_rows', help='Total number of rows of the mix, split between the datasets by their weights.', type=int, default=None)
+    parser.add_argument("--shuffle-buffer", "--shuffle_buffer", dest='shuffle_buffer', help='Number of rows held in the shuffle buffer of the mix. Default: 10000.', type=int, default=10_000)
+    parser.add_argument('-k', "--num-shards", "--num_shards", dest='num_shards', help='Number of machines to split the build across. Every machine builds a contiguous part of every dataset. Default: 1.', type=int, default=1)
+    parser.add_argument('-i', "--shard-index", "--shard_index", dest='shard_index', help='Index of this machine, from 0 to --num-shards minus one. Default: 0.', type=int, default=0)
+    parser.add_argument("--dry-run", "--dry_run", dest='dry_run', help='Only estimate the rows, output size and time of the build from a sample of every dataset, and check them against the free disk space.', action='store_true')
+    parser.add_argument("--dry-run-rows", "--dry_run_rows", dest='dry_run_rows', help=f'Number of source rows to sample per dataset for --dry-run. Default: {DEFAULT_SAMPLE_SIZE}.', type=int, default=DEFAULT_SAMPLE_SIZE)
+    parser.add_argument('-f', "--force", help='Rebuild every dataset from scratch instead of skipping finished outputs and resuming interrupted ones.', action='store_true')
     args = parser.parse_args()
 
-    datasets = args.datasets.split(',') if args.datasets != 'all' else list(PROCESSOR_MAP.keys())
-    for dataset in (pbar := tqdm(datasets)):
-        # Update the progress bar for the current dataset.
-        pbar.write(f"Processing dataset '{dataset}'")
-        processor = PROCESSOR_MAP[dataset]
-        processor.set_num_iterations(args.num_iterations)
-        processor.augment()
-        processor.write()
-
-    dataset_str = ', '.join(datasets[:-1])
-    if len(datasets) > 2:
-        dataset_str += f" and {datasets[-1]} have"
-        dataset_str = "Datasets " + dataset_str
+    datasets = parse_datasets(parser, args.datasets)
+    args.metadata_columns = tuple(args.metadata_columns.split(',')) if args.metadata_columns != 'none' else ()
+    if (unknown_columns := [column for column in args.metadata_columns if column not in METADATA_COLUMNS]):
+        parser.error(f"Unknown metadata column(s): {', '.join(unknown_columns)}. Valid columns: {', '.join(METADATA_COLUMNS)}.")
+    if args.num_shards < 1 or not 0 <= args.shard_index < args.num_shards:
+        parser.error(f"--shard-index must be between 0 and {args.num_shards - 1}.")
+    if args.num_shards > 1 and args.mix is not None:
+        parser.error("--mix cannot be split across several machines.")
+    if args.dry_run and args.mix is not None:
+        parser.error("--dry-run cannot estimate a --mix.")
+    if args.mix is not None:
+        # The datasets and their number of rows come from --mix, and a mix is always written from scratch.
+        mix_conflicts = {
+            "--datasets": args.datasets != 'all',
+            "--num_iterations": args.num_iterations != 1,
+            "--dedup": args.dedup != 'none',
+            "--force": args.force,
+        }
+        if (conflicting_options := [option for option, given in mix_conflicts.items() if given]):
+            parser.error(f"--mix cannot be combined with {', '.join(conflicting_options)}.")
+    if args.num_shards > 1 and args.seed is None:
+        parser.error("Every machine needs the same --seed when the build is split across several machines.")
+    if args.prefetch < 0 or args.write_queue < 0:
+        parser.error("--prefetch and --write-queue cannot be negative.")
+    if args.output_format == 'arrow' and args.compression == 'gzip':
+        parser.error("Arrow output does not support gzip compression. Use --compression zstd or none.")
+    # Without --compression, Parquet is compressed with zstd and the other formats are not compressed.
+    compression = args.compression if args.compression is not None else ('zstd' if args.output_format == 'parquet' else 'none')
+    if args.compression_level is not None and compression == 'none':
+        parser.error("--compression-level needs a compression scheme. Pass --compression gzip or zstd as well.")
+    if compression == 'zstd' and args.output_format == 'jsonl' and importlib.util.find_spec('zstandard') is None:
+        parser.error("zstd compression of jsonl output requires the `zstandard` package. Install it with `pip3 install zstandard`.")
+    if args.mix is not None:
+        if args.seed is None:
+            args.seed = get_random_seed()
+            print(f"Using seed {args.seed}. Pass `--seed {args.seed}` to reproduce this mix.")
+        build_mix(parser, args)
+        return
+    args.seeds = get_dataset_seeds(datasets, args.seed, reuse=not args.force)
+    if args.dry_run:
+        dry_run(datasets, args)
+        return
+
+    # A failing dataset is reported, but does not stop the other datasets from being built.
+    failed_datasets = []
+    if args.jobs <= 1:
+        processors = load_processors(datasets, args)
+        if args.prefetch > 0:
+            # Load the next datasets in the background while the current one is being built.
+            processors = prefetch(processors, max_pending=args.prefetch)
+        for dataset, processor, error in (pbar := tqdm(processors, total=len(datasets))):
+            # Update the progress bar for the current dataset.
+            pbar.write(f"Processing dataset '{dataset}'")
+            try:
+                if error is not None:
+                    raise RuntimeError(f"Loading the dataset failed:\n{error}")
+                summary = write_dataset(processor, args)
+            except Exception:
+                pbar.write(f"Dataset '{dataset}' failed:\n{traceback.format_exc()}")
+                failed_datasets.append(dataset)
+                continue
+            if summary is not None:
+                pbar.write(summary)
     else:
-        dataset_str = dataset_str[:-2] + datasets[-1]
-        dataset_str = f"Datasets {dataset_str} have" if len(datasets) > 1 \
-        else f"Dataset {dataset_str} has"
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(datasets))) as executor:
+            futures = {executor.submit(build_dataset, dataset, args): dataset for dataset in datasets}
+            for future in (pbar := tqdm(as_completed(futures), total=len(futures))):
+                dataset = futures[future]
+                if (exception := future.exception()) is not None:
+                    # The remote traceback of the worker is attached as the cause of the exception.
+                    pbar.write(f"Dataset '{dataset}' failed:\n{''.join(traceback.format_exception(exception))}")
+                    failed_datasets.append(dataset)
+                else:
+                    pbar.write(f"Finished dataset '{dataset}'")
+                    if (summary := future.result()) is not None:
+                        pbar.write(summary)
+
+    datasets = [dataset for dataset in datasets if dataset not in failed_datasets]
+    if datasets:
+        dataset_str = ', '.join(datasets[:-1])
+        if len(datasets) > 2:
+            dataset_str += f" and {datasets[-1]} have"
+            dataset_str = "Datasets " + dataset_str
+        else:
+            dataset_str = dataset_str[:-2] + datasets[-1]
+            dataset_str = f"Datasets {dataset_str} have" if len(datasets) > 1 \
+            else f"Dataset {dataset_str} has"
 
-    print(f"{dataset_str} been augmented and saved to disk. Check the output directories for the augmented datasets.")
+        print(f"{dataset_str} been augmented and saved to disk. Check the output directories for the augmented datasets.")
+    if failed_datasets:
+        print(f"Failed to build: {', '.join(failed_datasets)}.")
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1 @@
+from .streaming import AugmentedStream, iter_augmented
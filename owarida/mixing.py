@@ -0,0 +1,150 @@
+# Utils for interleaving several augmented datasets into a single, shuffled stream.
+import random
+
+from typing import Iterable, Iterator, Optional
+
+from .processors import BaseProcessor
+from .streaming import iter_augmented
+from .utils import get_writer, remove_shards
+
+def parse_mix(mix: str) -> dict[str, float]:
+    '''
+    Parses a dataset mix such as `arc_easy:1,winogrande:3` into a mapping of dataset names to weights.
+    Datasets without a weight get a weight of 1.
+    Args:
+        mix: The dataset mix.
+    Returns:
+        The weight of every dataset in the mix.
+    '''
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.strip().partition(':')
+        weights[name] = float(weight) if weight else 1.0
+        if weights[name] < 0:
+            raise ValueError(f"Weight of dataset '{name}' must not be negative.")
+    if sum(weights.values()) <= 0:
+        raise ValueError("At least one dataset needs a positive weight.")
+    return weights
+
+def get_mix_counts(weights: dict[str, float], num_rows: Optional[int] = None) -> dict[str, int]:
+    '''
+    Returns how many rows every dataset contributes to a mix.
+    Args:
+        weights: The weight of every dataset.
+        num_rows: The total number of rows of the mix, split between the datasets in proportion to their weights.
+        Set to None to take the weights as the number of rows of every dataset instead.
+    Returns:
+        The number of rows of every dataset.
+    '''
+    if num_rows is None:
+        if any(weight != int(weight) for weight in weights.values()):
+            raise ValueError("Without a total number of rows, the weights must be whole numbers of rows.")
+        return {name: int(weight) for name, weight in weights.items()}
+    # Split by largest remainder, so that the counts add up to exactly `num_rows`.
+    total_weight = sum(weights.values())
+    shares = {name: num_rows * weight / total_weight for name, weight in weights.items()}
+    counts = {name: int(share) for name, share in shares.items()}
+    leftover = num_rows - sum(counts.values())
+    for name in sorted(shares, key=lambda name: counts[name] - shares[name])[:leftover]:
+        counts[name] += 1
+    return counts
+
+def interleave(streams: dict[str, Iterator[dict]], counts: dict[str, int], rng: random.Random) -> Iterator[dict]:
+    '''
+    Interleaves several streams, taking exactly `counts[name]` rows from every stream.
+    Every row is drawn from a stream with a probability proportional to the rows it has left to give,
+    so the streams are spread evenly over the whole mix.
+    Args:
+        streams: The stream of every dataset.
+        counts: The number of rows to take from every stream.
+        rng: The random number generator to pick the streams with.
+    Returns:
+        An iterator over the interleaved rows.
+    '''
+    remaining = {name: count for name, count in counts.items() if count > 0}
+    total = sum(remaining.values())
+    while total > 0:
+        pick = rng.randrange(total)
+        for name, count in remaining.items():
+            if pick < count:
+                break
+            pick -= count
+        yield next(streams[name])
+        remaining[name] -= 1
+        total -= 1
+        if remaining[name] == 0:
+            del remaining[name]
+
+def shuffle_buffered(rows: Iterable[dict], buffer_size: int, rng: random.Random) -> Iterator[dict]:
+    '''
+    Shuffles a stream of rows with a buffer of bounded size: every incoming row takes the place
+    of a random row from the buffer, which is yielded. Memory stays bounded by the buffer size.
+    Args:
+        rows: The rows to shuffle.
+        buffer_size: The number of rows to hold in the buffer. The larger, the more thorough the shuffle.
+        rng: The random number generator to shuffle with.
+    Returns:
+        An iterator over the shuffled rows.
+    '''
+    buffer = []
+    for row in rows:
+        if len(buffer) < buffer_size:
+            buffer.append(row)
+            continue
+        idx = rng.randrange(buffer_size)
+        yield buffer[idx]
+        buffer[idx] = row
+    rng.shuffle(buffer)
+    yield from buffer
+
+def _tag_rows(rows: Iterator[dict], dataset_name: str) -> Iterator[dict]:
+    '''
+    Tags every row with the dataset it came from.
+    '''
+    for row in rows:
+        yield {**row, "dataset": dataset_name}
+
+def iter_mix(processors: dict[str, BaseProcessor], counts: dict[str, int], seed: int, shuffle_buffer: int = 10_000) -> Iterator[dict]:
+    '''
+    Augments several datasets at once and interleaves their rows into a single shuffled stream.
+    Every dataset is augmented on the fly (see `iter_augmented`), going over it for as many epochs as its count needs.
+    Args:
+        processors: The processor of every dataset.
+        counts: The number of rows every dataset contributes.
+        seed: The seed to derive every random choice from.
+        shuffle_buffer: The number of rows to hold in the shuffle buffer. Set to 0 to not shuffle beyond the interleaving.
+    Returns:
+        An iterator over the mixed rows, each tagged with the dataset it came from.
+    '''
+    streams = {name: _tag_rows(iter_augmented(processor, seed, epochs=None), name) for name, processor in processors.items()}
+    rows = interleave(streams, counts, random.Random(f"{seed}:mix"))
+    if shuffle_buffer > 0:
+        rows = shuffle_buffered(rows, shuffle_buffer, random.Random(f"{seed}:shuffle"))
+    return rows
+
+def write_mix(
+    processors: dict[str, BaseProcessor],
+    counts: dict[str, int],
+    seed: int,
+    output_dir: str,
+    shuffle_buffer: int = 10_000,
+    **writer_kwargs
+) -> int:
+    '''
+    Writes a mix of several datasets to disk as a single stream of shards, without building the datasets first.
+    Args:
+        processors: The processor of every dataset.
+        counts: The number of rows every dataset contributes.
+        seed: The seed to derive every random choice from.
+        output_dir: The directory to write the mix to.
+        shuffle_buffer: The number of rows to hold in the shuffle buffer.
+        writer_kwargs: Passed on to `get_writer` (output_format, compression, compression_level, max_rows, max_bytes, ...).
+    Returns:
+        The number of rows written.
+    '''
+    remove_shards(output_dir)
+    with get_writer(output_dir, **writer_kwargs) as writer:
+        # Rows of a mix do not belong together, so every row is its own group and shards are never overfilled.
+        for row in iter_mix(processors, counts, seed, shuffle_buffer):
+            writer.write([row])
+    return writer.num_rows
@@ -1,9 +1,34 @@
-from .arc import ArcProcessor
+from importlib import import_module
+
 from .base import BaseProcessor
-from .winogrande import WinograndeProcessor
 
-PROCESSOR_MAP: dict[str, BaseProcessor] = {
-    'arc_challenge': ArcProcessor(split_name='challenge'),
-    'arc_easy': ArcProcessor(split_name='easy'),
-    'winogrande': WinograndeProcessor()
+# Every dataset which can be augmented, mapped to the module and class of its processor and the arguments to construct it with.
+# Processors download their dataset when they are constructed, so they are only imported and constructed
+# once they are asked for with `get_processor`.
+PROCESSOR_MAP: dict[str, tuple[str, str, dict]] = {
+    'arc_challenge': ('.arc', 'ArcProcessor', {'split_name': 'challenge'}),
+    'arc_easy': ('.arc', 'ArcProcessor', {'split_name': 'easy'}),
+    'winogrande': ('.winogrande', 'WinograndeProcessor', {}),
 }
+
+def get_processor(dataset_name: str, **kwargs) -> BaseProcessor:
+    '''
+    Constructs the processor for a dataset, which downloads the dataset if needed.
+    Args:
+        dataset_name: The name of the dataset. Must be a key of `PROCESSOR_MAP`.
+        kwargs: Extra arguments to construct the processor with (e.g. `local_dir`).
+    Returns:
+        The processor for the dataset.
+    '''
+    if dataset_name not in PROCESSOR_MAP:
+        raise KeyError(f"Unknown dataset '{dataset_name}'. Valid datasets: {', '.join(PROCESSOR_MAP)}.")
+    module_name, class_name, _ = PROCESSOR_MAP[dataset_name]
+    processor_class = getattr(import_module(module_name, __name__), class_name)
+    return processor_class(**PROCESSOR_MAP[dataset_name][2], **kwargs)
+
+def __getattr__(name: str):
+    # Import the processor classes on first access, as importing them pulls in `datasets`.
+    for module_name, class_name, _ in PROCESSOR_MAP.values():
+        if name == class_name:
+            return getattr(import_module(module_name, __name__), class_name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
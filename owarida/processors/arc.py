@@ -2,43 +2,23 @@ import random
 
 from typing import Optional
 
-from datasets import Dataset, concatenate_datasets, load_dataset
+from datasets import Dataset, load_dataset
 
 from .base import BaseProcessor
-from ..utils import (
-    AnswerChoice,
-    get_data_dir,
-    get_templates,
-    get_output_dir,
-    select_template
-)
+from ..utils import AnswerChoice, select_template
 
 class ArcProcessor(BaseProcessor):
-    def __init__(self, split_name: str) -> None:
+    def __init__(self, split_name: str, local_dir: Optional[str] = None) -> None:
         '''
         The processor for the ARC dataset.
         Args:
             split_name: The split of the dataset to use. Only valid splits: 'easy', 'challenge'.
+            local_dir: The directory holding a local copy of the split. Set to None to download it instead.
         '''
-        self.data_dir = get_data_dir(f'arc_{split_name}')
-        self.output_dir = get_output_dir(f'arc_{split_name}')
+        super().__init__(f'arc_{split_name}', templates_name='arc')
         self.full_split_name = 'ARC-Easy' if split_name == 'easy' else 'ARC-Challenge'
-        self.num_iterations = 0 # To be set later.
 
-        self.dataset = self.download()
-        self.new_dataset = None # Placeholder for the augmented dataset.
-        self.templates = None
-
-    def augment(self):
-        self.templates = get_templates('arc')
-        for _ in range(self.num_iterations):
-            if self.new_dataset is None:
-                # First run of augmentations. Create the first one by applying augmentations to old dataset.
-                self.new_dataset = self.dataset.map(self._augment_one, remove_columns=self.dataset.column_names,) #batched=True)
-            else:
-                # New runs of augmentations. Append the new augmentations to the existing dataset.
-                temp_dataset = self.dataset.map(self._augment_one, remove_columns=self.dataset.column_names, batched=True)
-                self.new_dataset = concatenate_datasets([self.new_dataset, temp_dataset])
+        self.dataset = self.load(local_dir)
 
     def download(self) -> Dataset:
         '''
@@ -51,37 +31,20 @@ class ArcProcessor(BaseProcessor):
             cache_dir=self.data_dir # Saves the files locally.
         )
         return dataset
-    
-    def set_num_iterations(self, num_iterations: int) -> None:
-        '''
-        Sets the number of iterations to augment the dataset.
-        Args:
-            num_iterations: The number of iterations.
-        '''
-        self.num_iterations = num_iterations
-    
-    def write(self, output_dir: Optional[str] = None) -> None:
-        '''
-        Writes the augmented dataset to disk.
-        Args:
-            data_dir: The directory to write the augmented dataset to,
-            if it needs to be something other than the default. Set to None to use the default.
-        '''
-        output_dir = output_dir if output_dir is not None else self.output_dir
-        self.new_dataset.to_json(
-            f"{output_dir}/augmented.jsonl",
-            orient="records",
-            lines=True
-        )
-    
-    def _augment_one(self, entry: dict) -> dict:
+
+    def _augment_one(self, entry: dict, rng: Optional[random.Random] = None) -> dict:
         '''
         Takes a single entry from the dataset and augments it by applying a template to it.
-        The output is in ShareGPT format, which is what we use as our dataset format.
+        The output is in ShareGPT format, which is what we use as our dataset format,
+        along with the name of the template that was applied.
+        Args:
+            entry: The entry to augment.
+            rng: The random number generator to make every random choice with. Set to None to use the global one.
         '''
-        augmented_entry = select_template(self.templates)
-        # First, we substitute "{{question}}" in with the actual question.
-        augmented_entry = augmented_entry.replace("{{question}}", entry['question'])
+        rng = rng if rng is not None else random
+        template = select_template(self.templates, rng)
+        # First, we fill in the actual question.
+        values = {"question": entry['question']}
 
         # Get the correct answer now so that we can assign the right letter to it later
         # during letter choice scrambling.
@@ -91,41 +54,33 @@ class ArcProcessor(BaseProcessor):
         else:
             answer_idx = getattr(AnswerChoice, entry['answerKey']).value
         correct_answer = entry['choices']['text'][answer_idx]
-        augmented_entry = augmented_entry.replace("{{answer}}", correct_answer)
+        values["answer"] = correct_answer
 
         # Closed QA task.
-        if "answer_choices}}" in augmented_entry:
+        if "answer_choices" in template.placeholders or "jumbled_answer_choices" in template.placeholders:
             # Choose a random separator for the purposes of further generalizing.
-            separator = random.choice([": ", " - ", ") ", ". "])
+            separator = rng.choice([": ", " - ", ") ", ". "])
 
             # Now we can shuffle the answer choices...
-            answers = entry['choices']['text']
-            random.shuffle(answers)
+            answers = list(entry['choices']['text'])
+            rng.shuffle(answers)
             # ...get the new letter for the correct answer...
             correct_answer_idx = answers.index(correct_answer)
             # ...and do a reverse lookup on the enum to find the new letter, if the answer choice isn't numeric.
             correct_answer_letter = AnswerChoice(correct_answer_idx).name if not numeric_answer else str(correct_answer_idx + 1)
             # Sometimes lowercase the letters too, to account for case-sensitive tokenizers.
             lowered_letters = False
-            if random.random() < 0.5:
+            if rng.random() < 0.5:
                 lowered_letters = True
                 correct_answer_letter = correct_answer_letter.lower()
 
             # There are two potential ways to format the answer choices in the ARC templates.
             # The first is {{letter_with_answer}}, which combines the letter, the separator, and the answer in one go.
-            if "{{letter_with_answer}}" in augmented_entry:
-                correct_answer = f"{correct_answer_letter}{separator}{correct_answer}"
-                augmented_entry = augmented_entry.replace("{{letter_with_answer}}", correct_answer)
             # The other scenario is where the letter and the answer are separately mentioned in the template.
-            else:
-                # We replace {{letter}} with the correct letter.
-                augmented_entry = augmented_entry.replace("{{letter}}", correct_answer_letter)
-                # And replace {{answer}} with the correct answer.
-                augmented_entry = augmented_entry.replace("{{answer}}", correct_answer)
+            values["letter_with_answer"] = f"{correct_answer_letter}{separator}{correct_answer}"
+            values["letter"] = correct_answer_letter
 
-            # Finally, we have to insert the answer choices into the template.
-            answer_choices = ""
-            str_to_replace = "{{answer_choices}}"
+            # Finally, we have to build the answer choices for the template.
             # Iterate over the enum.
             enum_iterator = list(AnswerChoice)
             # Knock out the enum iterator if the number of answer choices is less than the number of enum values.
@@ -135,20 +90,19 @@ class ArcProcessor(BaseProcessor):
             # One of the templates designed to boost generalizaiton
             # is where answer choices are not in alphabetical/numerical order but rather scrambled.
             # Check for that and if this exists, scramble the enum iterator.
-            if "{{jumbled_answer_choices}}" in augmented_entry:
-                random.shuffle(enum_iterator)
-                str_to_replace = "{{jumbled_answer_choices}}"
+            if "jumbled_answer_choices" in template.placeholders:
+                rng.shuffle(enum_iterator)
 
+            answer_choices = []
             for i in enum_iterator:
                 try:
                     if numeric_answer:
-                        answer_choices += f"{i.value + 1}{separator}{answers[i.value]}\n"
+                        answer_choices.append(f"{i.value + 1}{separator}{answers[i.value]}")
                     else:
                         letter = i.name.lower() if lowered_letters else i.name
-                        answer_choices += f"{letter}{separator}{answers[i.value]}\n"
+                        answer_choices.append(f"{letter}{separator}{answers[i.value]}")
                 except IndexError:
                     print(f"IndexError: i.value: {i.value}, answers: {answers}, len(answers): {len(answers)}")
-            # Replace the answer choices in the template.
-            augmented_entry = augmented_entry.replace(str_to_replace, answer_choices.strip())
+            values["answer_choices"] = values["jumbled_answer_choices"] = "\n".join(answer_choices).strip()
 
-        return self._return_sharegpt(augmented_entry)
+        return {**self._return_sharegpt(template.render(values, rng, self.metrics.template_usage)), "template": template.name}
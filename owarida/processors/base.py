@@ -1,21 +1,173 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
 from abc import ABC, abstractmethod
+from collections import Counter, deque
+from typing import Iterator, Optional
+
+from ..utils import (
+    BackgroundConsumer,
+    BuildMetrics,
+    Deduplicator,
+    get_data_dir,
+    get_dataset_bytes,
+    get_finished_shards,
+    get_node_dir,
+    get_node_range,
+    get_random_seed,
+    get_record_rng,
+    get_record_rngs,
+    get_record_text,
+    get_templates,
+    get_output_dir,
+    get_writer,
+    hash_code,
+    hash_source_files,
+    hash_templates,
+    iter_shard_records,
+    load_manifest,
+    remove_shards,
+    save_manifest
+)
+
+# Default number of augmented rows produced at once.
+DEFAULT_BATCH_SIZE = 1000
+
+# Default number of augmented batches which can wait for the writer thread of `BaseProcessor.write`.
+# Bounds the memory held by batches which have been augmented but not written yet.
+DEFAULT_WRITE_QUEUE_SIZE = 4
+
+# Columns which can be written along with the conversations of every augmented row.
+METADATA_COLUMNS = ('source_id', 'iteration', 'template')
+
+# Default number of source entries augmented to estimate the size of a build.
+DEFAULT_SAMPLE_SIZE = 1000
 
-from ..utils import get_data_dir, get_templates, get_output_dir
+# How often a duplicate row is drawn again before it is dropped, when duplicates are resampled.
+MAX_RESAMPLES = 3
+
+# The processor used by the worker processes of `BaseProcessor._iter_augmented_batches`.
+# It is set once per worker so that the processor is not sent along with every batch.
+_worker_processor = None
+
+def _init_worker(processor: "BaseProcessor") -> None:
+    global _worker_processor
+    _worker_processor = processor
+
+def _augment_in_worker(batch: dict[str, list], indices: list[int]) -> tuple[dict[str, list], Counter]:
+    # Hand the template usage of the batch back along with it, so that it can be counted in the main process.
+    augmented_batch = _worker_processor._augment_batch(batch, indices)
+    template_usage = _worker_processor.metrics.template_usage
+    _worker_processor.metrics.template_usage = Counter()
+    return augmented_batch, template_usage
 
 class BaseProcessor(ABC):
-    def __init__(self):
+    def __init__(self, dataset_name: str, templates_name: str) -> None:
         '''
         The base class for all processors.
+        Args:
+            dataset_name: The name of the dataset, used for the data and output directories.
+            templates_name: The name of the template directory to use for the dataset.
         '''
+        self.dataset_name = dataset_name
+        self.templates_name = templates_name
+        self.data_dir = get_data_dir(dataset_name)
+        self.output_dir = get_output_dir(dataset_name)
         self.num_iterations = 0 # To be set later.
-    
-    @abstractmethod
-    def augment(self):
+        self.seed = get_random_seed() # Can be overridden with `set_seed` for reproducible builds.
+        # The part of the dataset this machine builds, out of how many. Can be set with `set_shard`.
+        self.shard_index = 0
+        self.num_shards = 1
+
+        self.dataset = None # To be set by the subclass, usually with `download`.
+        self.source_hash = None # Set by `load`, from the contents of the source files.
+        self.new_dataset = None # Placeholder for the augmented dataset.
+        self.templates = None
+        self.metrics = BuildMetrics(dataset_name)
+
+    def augment(self, batch_size: int = DEFAULT_BATCH_SIZE, num_proc: Optional[int] = None) -> None:
         '''
         This code augments by applying templates to the data.
+        Every iteration is generated in a single pass over the dataset: each entry fans out into
+        `num_iterations` augmented rows, tagged with the iteration they belong to.
+        Args:
+            batch_size: The number of augmented rows produced at once (see `get_entries_per_batch`).
+            num_proc: The number of processes to augment with. Set to None to augment in the current process.
         '''
-        raise NotImplementedError("This is an abstract class.")
-    
+        self.load_templates()
+        # Only the entries of this machine's shard are augmented (see `set_shard`).
+        node_start, node_end = self.get_node_range()
+        dataset = self.dataset.select(range(node_start, node_end)) if self.num_shards > 1 else self.dataset
+        self.new_dataset = dataset.map(
+            self._augment_batch,
+            batched=True,
+            with_indices=True,
+            batch_size=self.get_entries_per_batch(batch_size),
+            num_proc=num_proc,
+            remove_columns=self.dataset.column_names,
+            fn_kwargs={"index_offset": node_start}
+        )
+
+    def load(self, local_dir: Optional[str] = None):
+        '''
+        Loads the dataset, either from its source or from local files.
+        Args:
+            local_dir: The directory holding local copies of the dataset. Set to None to download it instead.
+        Returns:
+            The dataset.
+        '''
+        with self.metrics.time_stage("download"):
+            if local_dir is not None:
+                return self.load_local(local_dir)
+            dataset = self.download()
+            # The downloaded data is cached as Arrow files, which are hashed like local ones.
+            self.source_hash = hash_source_files([cache_file["filename"] for cache_file in dataset.cache_files])
+            return dataset
+
+    def load_templates(self) -> None:
+        '''
+        Loads and compiles the templates of the dataset.
+        '''
+        with self.metrics.time_stage("templates"):
+            self.templates = get_templates(self.templates_name)
+
+    def load_local(self, local_dir: str):
+        '''
+        Loads the dataset from files which have been staged locally, without going over the network.
+        The directory may hold a dataset saved with `Dataset.save_to_disk`, Arrow files or Parquet files.
+        The contents of the files are hashed into `source_hash`, so that copies staged anywhere count as the same source.
+        Arrow files are memory-mapped as they are, so that many processes can share one read-only copy.
+        Parquet files are converted to Arrow once, into the data directory of the dataset, and memory-mapped from there.
+        Args:
+            local_dir: The directory holding the local copy of the dataset.
+        Returns:
+            The dataset.
+        '''
+        from datasets import Dataset, concatenate_datasets, load_from_disk
+
+        if not os.path.isdir(local_dir):
+            raise FileNotFoundError(f"No local copy of dataset '{self.dataset_name}' found: '{local_dir}' is not a directory.")
+        if os.path.isfile(os.path.join(local_dir, "state.json")):
+            dataset = load_from_disk(local_dir)
+            self.source_hash = hash_source_files([cache_file["filename"] for cache_file in dataset.cache_files])
+            return dataset
+
+        # `Dataset.map` caches its results as `cache-*.arrow` next to the files a dataset was loaded from. Those are not source data.
+        file_names = [file_name for file_name in sorted(os.listdir(local_dir)) if not file_name.startswith("cache-")]
+        arrow_files = [os.path.join(local_dir, file_name) for file_name in file_names if file_name.endswith(".arrow")]
+        parquet_files = [os.path.join(local_dir, file_name) for file_name in file_names if file_name.endswith(".parquet")]
+        if arrow_files:
+            self.source_hash = hash_source_files(arrow_files)
+            datasets = [Dataset.from_file(path) for path in arrow_files]
+            return datasets[0] if len(datasets) == 1 else concatenate_datasets(datasets)
+        if parquet_files:
+            self.source_hash = hash_source_files(parquet_files)
+            return Dataset.from_parquet(parquet_files, cache_dir=self.data_dir)
+        raise FileNotFoundError(f"No local copy of dataset '{self.dataset_name}' found: '{local_dir}' has no Arrow or Parquet files.")
+
     @abstractmethod
     def download(self):
         '''
@@ -23,30 +175,409 @@ class BaseProcessor(ABC):
         otherwise from a different URL if possible.
         '''
         raise NotImplementedError("This is an abstract class.")
-    
+
     def set_num_iterations(self, num_iterations: int) -> None:
         '''
         Sets the number of iterations to augment the dataset.
         Args:
             num_iterations: The number of iterations.
         '''
+        if num_iterations < 1:
+            raise ValueError(f"The number of iterations must be at least 1, got {num_iterations}.")
         self.num_iterations = num_iterations
-    
-    @abstractmethod
-    def write(self):
+
+    def set_shard(self, shard_index: int, num_shards: int) -> None:
         '''
-        This code writes the newly-augmented data to disk in a specific output format (for now, forced jsonl).
+        Splits the build across several machines, of which this one only builds its own contiguous range
+        of the entries (with every iteration of them), into its own directory within the output directory.
+        The outputs of all machines can be merged with `merge_node_outputs` once they are done.
+        Args:
+            shard_index: The index of this machine, from 0 to `num_shards - 1`.
+            num_shards: The number of machines the build is split across.
         '''
-        raise NotImplementedError("This is an abstract class.")
-    
+        if num_shards < 1 or not 0 <= shard_index < num_shards:
+            raise ValueError(f"The shard index must be between 0 and the number of shards minus one, got {shard_index} of {num_shards}.")
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.output_dir = get_output_dir(self.dataset_name)
+        if num_shards > 1:
+            self.output_dir = get_node_dir(self.output_dir, num_shards, shard_index)
+
+    def get_node_range(self) -> tuple[int, int]:
+        '''
+        Returns the range of entries this machine builds (see `set_shard`).
+        '''
+        return get_node_range(len(self.dataset), self.num_shards, self.shard_index)
+
+    def get_entries_per_batch(self, batch_size: int) -> int:
+        '''
+        Returns how many source entries make up a batch of `batch_size` augmented rows.
+        Every entry fans out into `num_iterations` rows, so sizing batches in rows keeps their memory
+        (and that of every batch in flight or waiting to be written) flat no matter the number of iterations.
+        Args:
+            batch_size: The number of augmented rows per batch.
+        Returns:
+            The number of entries per batch, at least one.
+        '''
+        return max(1, batch_size // max(1, self.num_iterations))
+
+    def set_seed(self, seed: int) -> None:
+        '''
+        Sets the seed every per-record random number generator is derived from.
+        Args:
+            seed: The seed.
+        '''
+        self.seed = seed
+
+    def write(
+        self,
+        output_dir: Optional[str] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        num_proc: Optional[int] = None,
+        resume: bool = True,
+        dedup: Optional[str] = None,
+        dedup_action: str = 'drop',
+        output_format: str = 'jsonl',
+        metadata_columns: tuple[str, ...] = ('iteration',),
+        write_queue_size: int = DEFAULT_WRITE_QUEUE_SIZE,
+        **writer_kwargs
+    ) -> None:
+        '''
+        Writes the augmented dataset to disk as sharded (and optionally compressed) jsonl, Parquet or Arrow files.
+        If `augment` has not been called, the dataset is augmented on the fly and every batch is written
+        as soon as it has been produced, so that memory use does not grow with the number of iterations.
+        The output directory carries a manifest of everything the output depends on and of every finished shard.
+        If a previous build with the same inputs and options finished, nothing is done,
+        and if it was interrupted, the build continues after its last finished shard.
+        Args:
+            output_dir: The directory to write the augmented dataset to,
+            if it needs to be something other than the default. Set to None to use the default.
+            batch_size: The number of augmented rows produced at once (see `get_entries_per_batch`).
+            num_proc: The number of processes to augment with. Set to None to augment in the current process.
+            resume: Whether to reuse the output of a previous build. Set to False to always build from scratch.
+            dedup: Which duplicate rows to catch before they are written (see `Deduplicator`).
+            Valid options: None, 'exact', 'near'. Set to None to write every row.
+            dedup_action: What to do with a duplicate row. Valid options: 'drop' (leave it out),
+            'resample' (draw the row again, up to `MAX_RESAMPLES` times, and drop it if it is still a duplicate).
+            output_format: The format to write. Valid options: 'jsonl', 'parquet', 'arrow' (see `get_writer`).
+            metadata_columns: The columns to write along with the conversations of every row, out of `METADATA_COLUMNS`:
+            the index of the source entry ('source_id'), the iteration ('iteration') and the name of the template ('template').
+            write_queue_size: The maximum number of augmented batches waiting to be written by the writer thread.
+            Set to 0 to write every batch in the current thread, before the next one is augmented.
+            writer_kwargs: Passed on to the writer (compression, compression_level, max_rows, max_bytes, row_group_size).
+        '''
+        if (unknown_columns := [column for column in metadata_columns if column not in METADATA_COLUMNS]):
+            raise ValueError(f"Unknown metadata column(s): {', '.join(unknown_columns)}. Valid options: {', '.join(METADATA_COLUMNS)}.")
+        if dedup_action not in ('drop', 'resample'):
+            raise ValueError(f"Unknown dedup action '{dedup_action}'. Valid options: drop, resample.")
+        output_dir = output_dir if output_dir is not None else self.output_dir
+        deduplicator = Deduplicator(dedup) if dedup is not None else None
+        writer_kwargs = {"output_format": output_format, "columns": ["conversations", *metadata_columns], **writer_kwargs}
+        config = self.get_build_config(
+            dedup={"mode": dedup, "action": dedup_action} if dedup is not None else None,
+            **writer_kwargs
+        )
+        manifest = load_manifest(output_dir) if resume else None
+        if manifest is not None and manifest["config"] == config:
+            finished_shards = get_finished_shards(output_dir, manifest["shards"])
+            if manifest["complete"] and len(finished_shards) == len(manifest["shards"]):
+                print(f"Output of dataset '{self.dataset_name}' is up to date. Skipping.")
+                return
+            manifest["shards"] = finished_shards
+        else:
+            manifest = {"dataset": self.dataset_name, "config": config, "shards": [], "complete": False}
+        node_start, node_end = self.get_node_range()
+        if self.num_shards > 1:
+            manifest["node"] = {
+                "index": self.shard_index,
+                "num_shards": self.num_shards,
+                "start": node_start,
+                "end": node_end,
+                "num_source_rows": len(self.dataset),
+            }
+        manifest["complete"] = False
+        save_manifest(output_dir, manifest)
+
+        # Entries before `start` have already been written to the finished shards.
+        start = manifest["shards"][-1]["end"] if manifest["shards"] else node_start
+        remove_shards(output_dir, start_shard=len(manifest["shards"]))
+        if deduplicator is not None:
+            # Rows of the finished shards count as seen, so that a resumed build drops the same rows as a fresh one.
+            for shard in manifest["shards"]:
+                for record in iter_shard_records(os.path.join(output_dir, shard["file"])):
+                    deduplicator.add(deduplicator.fingerprint(get_record_text(record)))
+        if self.new_dataset is not None:
+            batches = self.new_dataset.select(
+                range((start - node_start) * self.num_iterations, len(self.new_dataset))
+            ).iter(batch_size=self.get_entries_per_batch(batch_size) * self.num_iterations)
+        else:
+            batches = self._iter_augmented_batches(batch_size, num_proc, start=start, end=node_end)
+
+        def finish_shard(shard: Optional[dict], end: int) -> None:
+            # Record the shard, along with the entries it covers, as finished.
+            nonlocal start
+            if shard is not None:
+                manifest["shards"].append({**shard, "start": start, "end": end})
+                save_manifest(output_dir, manifest)
+                start = end
+
+        def write_groups(groups: list[tuple[list[dict], int]]) -> None:
+            # Runs in the writer thread: serializes, compresses and records the shards of a batch.
+            with self.metrics.time_stage("write"):
+                for group, end in groups:
+                    finish_shard(writer.write(group), end)
+
+        build_start = time.perf_counter()
+        with get_writer(output_dir, start_shard=len(manifest["shards"]), **writer_kwargs) as writer:
+            end = start
+            batches = iter(batches)
+            # Augmented batches are written in a thread of their own while the next batches are augmented.
+            # Once `write_queue_size` batches are waiting, augmentation waits for the writer to catch up.
+            with BackgroundConsumer(write_groups, max_pending=write_queue_size, name=f"owarida-writer-{self.dataset_name}") as write_queue:
+                while True:
+                    # Augmentation happens lazily, so time how long it takes to get every batch.
+                    with self.metrics.time_stage("augment"):
+                        batch = next(batches, None)
+                    if batch is None:
+                        break
+                    records = [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
+                    groups = []
+                    # Keep the augmented rows of an entry together in the same shard.
+                    # Duplicates are caught here rather than in the writer thread, as catching them depends on the order of the rows.
+                    with self.metrics.time_stage("dedup" if deduplicator is not None else "augment"):
+                        for group_start in range(0, len(records), self.num_iterations):
+                            group = records[group_start:group_start + self.num_iterations]
+                            if deduplicator is not None:
+                                group = self._dedup_group(group, end, deduplicator, dedup_action)
+                            end += 1
+                            if group:
+                                groups.append((group, end))
+                    write_queue.submit(groups)
+            with self.metrics.time_stage("write"):
+                finish_shard(writer.close(), end)
+        self.metrics.add_time("build", time.perf_counter() - build_start)
+
+        manifest["complete"] = True
+        save_manifest(output_dir, manifest)
+        self.metrics.rows += writer.num_rows
+        self.metrics.output_bytes += writer.num_bytes
+        self.metrics.write(output_dir, self.templates)
+
+    def get_build_config(self, dedup: Optional[dict] = None, **writer_kwargs) -> dict:
+        '''
+        Returns everything the output of a build depends on, which is recorded in the build manifest.
+        Args:
+            dedup: The deduplication options of the build, or None if it does not deduplicate.
+            writer_kwargs: The options the output is written with.
+        Returns:
+            The hashes of the source data, the templates and the code, along with the seed,
+            the number of iterations, the deduplication options and the writer options.
+        '''
+        return {
+            # A hash of the contents of the source files, rather than `Dataset._fingerprint`,
+            # which changes with the path and modification time of local files.
+            "source": self.source_hash,
+            "templates": hash_templates(self.templates_name),
+            "code": hash_code(),
+            "seed": self.seed,
+            "num_iterations": self.num_iterations,
+            "dedup": dedup,
+            "writer": writer_kwargs,
+            # Only builds split across several machines record their part, so that merged outputs match single builds.
+            **({"node": {"index": self.shard_index, "num_shards": self.num_shards}} if self.num_shards > 1 else {}),
+        }
+
+    def estimate(
+        self,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        output_format: str = 'jsonl',
+        metadata_columns: tuple[str, ...] = ('iteration',),
+        **writer_kwargs
+    ) -> dict:
+        '''
+        Estimates the output of a build by augmenting and writing a random sample of the entries (with every iteration
+        of them) to a temporary directory with the given options, and extrapolating to every entry this machine builds.
+        The sample is taken in contiguous blocks, so that it is augmented the same way as a build.
+        Deduplication is left out, so the estimate is an upper bound for deduplicated builds.
+        Args:
+            sample_size: The number of entries to sample.
+            output_format: The format to write. Valid options: 'jsonl', 'parquet', 'arrow' (see `get_writer`).
+            metadata_columns: The columns to write along with the conversations of every row (see `write`).
+            writer_kwargs: Passed on to the writer (compression, compression_level, row_group_size).
+        Returns:
+            The number of source entries and output rows, the output size in bytes, the time to augment and write
+            in a single process in seconds, and the size of the source dataset in bytes.
+        '''
+        if self.templates is None:
+            self.load_templates()
+        node_start, node_end = self.get_node_range()
+        num_entries = node_end - node_start
+        sample_size = min(sample_size, num_entries)
+        # Sample blocks of up to 100 entries, spread evenly over the entries of this machine.
+        block_size = min(100, sample_size) or 1
+        num_blocks = (sample_size + block_size - 1) // block_size
+        rng = random.Random(f"{self.seed}:{self.dataset_name}:sample")
+        candidate_starts = range(node_start, node_end - block_size + 1, block_size)
+        block_starts = sorted(rng.sample(candidate_starts, min(num_blocks, len(candidate_starts))))
+
+        with tempfile.TemporaryDirectory() as sample_dir:
+            start_time = time.perf_counter()
+            with get_writer(sample_dir, output_format=output_format, columns=["conversations", *metadata_columns], **writer_kwargs) as writer:
+                for block_start in block_starts:
+                    indices = list(range(block_start, block_start + block_size))
+                    batch = self._augment_batch(self.dataset[block_start:block_start + block_size], indices)
+                    records = [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
+                    for group_start in range(0, len(records), self.num_iterations):
+                        writer.write(records[group_start:group_start + self.num_iterations])
+            seconds = time.perf_counter() - start_time
+            sample_rows = writer.num_rows
+            sample_bytes = writer.num_bytes
+
+        num_rows = num_entries * self.num_iterations
+        scale = num_rows / sample_rows if sample_rows > 0 else 0
+        return {
+            "dataset": self.dataset_name,
+            "entries": num_entries,
+            "rows": num_rows,
+            "sample_rows": sample_rows,
+            "bytes": round(sample_bytes * scale),
+            "seconds": seconds * scale,
+            "source_bytes": get_dataset_bytes(self.dataset),
+        }
+
+    def _dedup_group(self, records: list[dict], index: int, deduplicator: Deduplicator, action: str) -> list[dict]:
+        '''
+        Filters the augmented rows of a single entry through the deduplicator.
+        Every row that is kept is remembered, so that later repeats of it are caught as well.
+        Args:
+            records: The augmented rows of the entry.
+            index: The index of the entry in the dataset.
+            deduplicator: The deduplicator holding every row written so far.
+            action: What to do with a duplicate row: 'drop' or 'resample'.
+        Returns:
+            The rows to write.
+        '''
+        kept_records = []
+        entry = None
+        for record in records:
+            self.metrics.dedup["checked"] += 1
+            fingerprint = deduplicator.fingerprint(get_record_text(record))
+            if (duplicate := deduplicator.match(fingerprint)) is not None:
+                self.metrics.dedup[duplicate] += 1
+                attempt = 0
+                while duplicate is not None and action == 'resample' and attempt < MAX_RESAMPLES:
+                    # Draw the row again from a generator of its own, so that resampling stays reproducible.
+                    attempt += 1
+                    entry = entry if entry is not None else self.dataset[index]
+                    rng = get_record_rng(self.seed, self.dataset_name, record["iteration"], index, attempt)
+                    record = {**record, **self._augment_one(entry, rng)}
+                    fingerprint = deduplicator.fingerprint(get_record_text(record))
+                    duplicate = deduplicator.match(fingerprint)
+                if duplicate is not None:
+                    self.metrics.dedup["dropped"] += 1
+                    continue
+                self.metrics.dedup["resampled"] += 1
+            deduplicator.add(fingerprint)
+            kept_records.append(record)
+        return kept_records
+
+    def _iter_augmented_batches(
+        self,
+        batch_size: int,
+        num_proc: Optional[int] = None,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> Iterator[dict[str, list]]:
+        '''
+        Augments the dataset batch by batch, yielding every augmented batch in order as soon as it is ready.
+        With multiple processes, only a bounded number of batches is in flight at any time.
+        Args:
+            batch_size: The number of augmented rows produced at once (see `get_entries_per_batch`).
+            num_proc: The number of processes to augment with. Set to None to augment in the current process.
+            start: The index of the first entry to augment.
+            end: The index after the last entry to augment. Set to None to augment up to the end of the dataset.
+        '''
+        if self.templates is None:
+            self.load_templates()
+        batch_size = self.get_entries_per_batch(batch_size)
+        # Pair every batch with the indices of its entries, which seed their random number generators.
+        end = end if end is not None else len(self.dataset)
+        dataset = self.dataset.select(range(start, end)) if start > 0 or end < len(self.dataset) else self.dataset
+        batches = (
+            (batch, list(range(batch_start, min(batch_start + batch_size, end))))
+            for batch_start, batch in zip(range(start, end, batch_size), dataset.iter(batch_size=batch_size))
+        )
+        if num_proc is None or num_proc <= 1:
+            for batch, indices in batches:
+                yield self._augment_batch(batch, indices)
+            return
+
+        with multiprocessing.Pool(num_proc, initializer=_init_worker, initargs=(self,)) as pool:
+            pending = deque()
+            for batch, indices in batches:
+                pending.append(pool.apply_async(_augment_in_worker, (batch, indices)))
+                if len(pending) >= 2 * num_proc:
+                    augmented_batch, template_usage = pending.popleft().get()
+                    self.metrics.template_usage.update(template_usage)
+                    yield augmented_batch
+            while pending:
+                augmented_batch, template_usage = pending.popleft().get()
+                self.metrics.template_usage.update(template_usage)
+                yield augmented_batch
+
+    def _augment_batch(self, batch: dict[str, list], indices: list[int], index_offset: int = 0) -> dict[str, list]:
+        '''
+        This function takes a batch of entries in columnar form (as handed out by `Dataset.map` with `batched=True`)
+        and augments every entry in it `num_iterations` times with `_augment_one`.
+        The augmented rows of an entry are kept next to each other, and every one of them gets its own
+        random number generator, derived from the seed, the dataset, the iteration and the index of the entry.
+        Args:
+            batch: A mapping of column names to the values of that column for every entry in the batch.
+            indices: The indices of the entries in the dataset.
+            index_offset: Added to every index, for batches taken from a part of the dataset that does not start at 0.
+        Returns:
+            The augmented batch in columnar form, with `num_iterations` rows per entry.
+            Every row comes with the index of its entry, its iteration and the name of its template.
+        '''
+        columns = list(batch.keys())
+        num_rows = len(batch[columns[0]]) if columns else 0
+        conversations = []
+        source_ids = []
+        iterations = []
+        template_names = []
+        # Draw the random values of every row of the batch up front, one contiguous range of entries per iteration.
+        first_index = indices[0] + index_offset if num_rows > 0 else 0
+        if num_rows > 0 and indices[-1] - indices[0] == num_rows - 1:
+            rngs = [
+                get_record_rngs(self.seed, self.dataset_name, iteration, first_index, first_index + num_rows)
+                for iteration in range(self.num_iterations)
+            ]
+        else:
+            rngs = None
+        for idx in range(num_rows):
+            entry = {column: batch[column][idx] for column in columns}
+            index = indices[idx] + index_offset
+            for iteration in range(self.num_iterations):
+                if rngs is not None:
+                    rng = rngs[iteration][idx]
+                else:
+                    rng = get_record_rng(self.seed, self.dataset_name, iteration, index)
+                augmented_entry = self._augment_one(entry, rng)
+                conversations.append(augmented_entry["conversations"])
+                source_ids.append(index)
+                iterations.append(iteration)
+                template_names.append(augmented_entry["template"])
+        return {"conversations": conversations, "source_id": source_ids, "iteration": iterations, "template": template_names}
+
     @abstractmethod
-    def _augment_one(self):
+    def _augment_one(self, entry: dict, rng: Optional[random.Random] = None) -> dict:
         '''
         This function takes a singular entry and reformats it to follow one of the templates.
-        We then call map_dataset on this function to apply it to the entire dataset at once.
+        Returns the ShareGPT-formatted entry along with the name of the template (as "template").
+        `_augment_batch` calls this on every entry of a batch, which we then map over the entire dataset.
         '''
         raise NotImplementedError("This is an abstract class.")
-    
+
     def _return_sharegpt(self, augmented_entry: str) -> dict:
         '''
         Returns a ShareGPT-formatted dictionary.
@@ -0,0 +1,159 @@
+# A long-running augmentation service, which hands out augmented batches to many trainers over HTTP.
+import json
+import os
+import random
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from .mixing import parse_mix
+from .processors import BaseProcessor, get_processor
+
+# Upper bound on the batch size a client may ask for, so that a single request cannot hog the server.
+MAX_BATCH_SIZE = 4096
+
+class AugmentationServer:
+    def __init__(self, datasets: list[str], local_root: Optional[str] = None, max_clients: int = 8) -> None:
+        '''
+        Loads the processors and their compiled templates once, to serve augmented batches from them.
+        Args:
+            datasets: The names of the datasets to serve.
+            local_root: The directory holding local copies of the datasets (in `<local_root>/<dataset>`).
+            Set to None to download them instead.
+            max_clients: The maximum number of requests served at the same time. Further requests are turned away.
+        '''
+        self.processors: dict[str, BaseProcessor] = {}
+        for dataset in datasets:
+            processor = get_processor(dataset, local_dir=os.path.join(local_root, dataset) if local_root is not None else None)
+            processor.load_templates()
+            self.processors[dataset] = processor
+        self.client_slots = threading.BoundedSemaphore(max_clients)
+
+    def get_batch(self, weights: dict[str, float], batch_size: int, seed: int, step: int) -> list[dict]:
+        '''
+        Returns a batch of augmented conversations, drawn from the datasets according to their weights.
+        The same mix, batch size, seed and step always give the same batch.
+        Args:
+            weights: The weight of every dataset to draw from.
+            batch_size: The number of conversations in the batch.
+            seed: The seed of the stream the batch belongs to.
+            step: The index of the batch in the stream.
+        Returns:
+            The conversations, each along with the dataset and the index of the entry it was made from.
+        '''
+        if (unknown_datasets := [dataset for dataset in weights if dataset not in self.processors]):
+            raise ValueError(f"Dataset(s) not served: {', '.join(unknown_datasets)}. Served datasets: {', '.join(self.processors)}.")
+        rng = random.Random(f"{seed}:{','.join(f'{name}:{weight}' for name, weight in sorted(weights.items()))}:{step}")
+        datasets = rng.choices(list(weights), weights=list(weights.values()), k=batch_size)
+        batch = []
+        for dataset in datasets:
+            processor = self.processors[dataset]
+            index = rng.randrange(len(processor.dataset))
+            batch.append({
+                **processor._augment_one(processor.dataset[index], rng),
+                "dataset": dataset,
+                "index": index,
+            })
+        return batch
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8765) -> None:
+        '''
+        Serves batches over HTTP until interrupted. Endpoints:
+        - `GET /datasets`: The served datasets and their number of entries.
+        - `GET /batch?mix=arc_easy:1,winogrande:3&batch_size=32&seed=0&step=0`: A single batch as JSON.
+        - `GET /stream?mix=...&batch_size=32&seed=0&start_step=0&steps=100`: Consecutive batches as (chunked) JSON lines.
+        Batches are only produced as fast as the client reads them. Leave out `steps` to stream forever.
+        Args:
+            host: The host to listen on.
+            port: The port to listen on.
+        '''
+        server = ThreadingHTTPServer((host, port), _make_handler(self))
+        server.daemon_threads = True
+        print(f"Serving {', '.join(self.processors)} on http://{host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+def _make_handler(augmentation_server: AugmentationServer) -> type:
+    '''
+    Returns the request handler class for an augmentation server.
+    '''
+    class AugmentationRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == "/datasets":
+                self._send_json(200, {name: len(processor.dataset) for name, processor in augmentation_server.processors.items()})
+                return
+            if url.path not in ("/batch", "/stream"):
+                self._send_json(404, {"error": f"Unknown endpoint '{url.path}'."})
+                return
+
+            try:
+                weights = parse_mix(params.get("mix", ",".join(augmentation_server.processors)))
+                batch_size = int(params.get("batch_size", 32))
+                seed = int(params.get("seed", 0))
+                step = int(params.get("step", params.get("start_step", 0)))
+                steps = int(params["steps"]) if "steps" in params else None
+                if not 0 < batch_size <= MAX_BATCH_SIZE:
+                    raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}.")
+                if steps is not None and steps < 1:
+                    raise ValueError("steps must be at least 1.")
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+
+            if not augmentation_server.client_slots.acquire(blocking=False):
+                self._send_json(503, {"error": "Too many clients. Try again later."})
+                return
+            try:
+                if url.path == "/batch":
+                    self._send_json(200, {"step": step, "batch": augmentation_server.get_batch(weights, batch_size, seed, step)})
+                else:
+                    self._stream(weights, batch_size, seed, step, steps)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away mid-stream.
+                pass
+            finally:
+                augmentation_server.client_slots.release()
+
+        def _stream(self, weights: dict[str, float], batch_size: int, seed: int, start_step: int, steps: Optional[int]) -> None:
+            # Produce the first batch before the headers go out, so that errors can still be reported properly.
+            batch = augmentation_server.get_batch(weights, batch_size, seed, start_step)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            step = start_step
+            while True:
+                # Writing blocks while the client is not reading, which holds back the next batch.
+                line = json.dumps({"step": step, "batch": batch}, ensure_ascii=False).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+                step += 1
+                if steps is not None and step >= start_step + steps:
+                    break
+                batch = augmentation_server.get_batch(weights, batch_size, seed, step)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _send_json(self, status: int, body: object) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            # Keep the console quiet; trainers poll a lot.
+            pass
+
+    return AugmentationRequestHandler
@@ -0,0 +1,98 @@
+# On-the-fly augmentation, for consuming OWARIDA directly from a training dataloader instead of from files on disk.
+import random
+import sys
+
+from typing import Iterator, Optional, Union
+
+from .processors import BaseProcessor, get_processor
+from .utils import get_record_rng
+
+# Number of entries fetched from the source dataset at once.
+FETCH_SIZE = 1000
+
+def _get_worker_split(worker_id: Optional[int], num_workers: Optional[int]) -> tuple[int, int]:
+    '''
+    Returns which part of the data this worker should produce. If not given, the split is taken from
+    the PyTorch dataloader worker this runs in (if any), so that every worker produces different rows.
+    '''
+    if worker_id is None and num_workers is None and 'torch' in sys.modules:
+        from torch.utils.data import get_worker_info
+        if (worker_info := get_worker_info()) is not None:
+            return worker_info.id, worker_info.num_workers
+    return worker_id or 0, num_workers or 1
+
+def iter_augmented(
+    dataset: Union[str, BaseProcessor],
+    seed: int = 0,
+    epochs: Optional[int] = 1,
+    start_epoch: int = 0,
+    shuffle: bool = True,
+    worker_id: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    local_dir: Optional[str] = None
+) -> Iterator[dict]:
+    '''
+    Lazily augments a dataset, yielding one ShareGPT-formatted conversation at a time.
+    Every epoch goes over the whole dataset once with fresh templates and variants. Epoch `e` of a row
+    is the same conversation that a build with the same seed writes as iteration `e` of that row.
+    Args:
+        dataset: The name of the dataset (see `PROCESSOR_MAP`), or an already constructed processor.
+        seed: The seed to derive every random choice from.
+        epochs: The number of epochs to go over the dataset for. Set to None to go on forever.
+        start_epoch: The epoch to start at, e.g. when resuming training.
+        shuffle: Whether to shuffle the order of the rows in every epoch.
+        worker_id: The index of this worker, if the rows should be split between several workers.
+        num_workers: The number of workers the rows are split between. Inside a PyTorch dataloader worker,
+        `worker_id` and `num_workers` default to those of the worker.
+        local_dir: The directory holding a local copy of the dataset, if `dataset` is a name. Set to None to download it.
+    Returns:
+        An iterator over the augmented conversations, each along with the epoch it belongs to (as "iteration").
+    '''
+    processor = get_processor(dataset, local_dir=local_dir) if isinstance(dataset, str) else dataset
+    if processor.templates is None:
+        processor.load_templates()
+    worker_id, num_workers = _get_worker_split(worker_id, num_workers)
+    # Without any rows, an endless stream would never yield anything.
+    if len(processor.dataset) == 0:
+        raise ValueError(f"Dataset '{processor.dataset_name}' is empty, so there is nothing to augment.")
+    if worker_id >= len(processor.dataset):
+        raise ValueError(f"Worker {worker_id} gets no rows: dataset '{processor.dataset_name}' only has {len(processor.dataset)} rows for {num_workers} workers.")
+
+    epoch = start_epoch
+    while epochs is None or epoch < start_epoch + epochs:
+        order = list(range(len(processor.dataset)))
+        if shuffle:
+            random.Random(f"{seed}:{processor.dataset_name}:order:{epoch}").shuffle(order)
+        # Every worker takes every `num_workers`-th row, so workers never produce the same row.
+        order = order[worker_id::num_workers]
+
+        for start in range(0, len(order), FETCH_SIZE):
+            indices = order[start:start + FETCH_SIZE]
+            batch = processor.dataset[indices]
+            for idx, index in enumerate(indices):
+                entry = {column: values[idx] for column, values in batch.items()}
+                rng = get_record_rng(seed, processor.dataset_name, epoch, index)
+                yield {**processor._augment_one(entry, rng), "iteration": epoch}
+        epoch += 1
+
+class AugmentedStream:
+    def __init__(self, dataset: Union[str, BaseProcessor], seed: int = 0, epochs: Optional[int] = 1, **kwargs) -> None:
+        '''
+        A re-iterable wrapper around `iter_augmented`, e.g. for use as a PyTorch `IterableDataset`.
+        Every iteration over it starts a fresh pass with the same arguments.
+        Args:
+            dataset: The name of the dataset (see `PROCESSOR_MAP`), or an already constructed processor.
+            seed: The seed to derive every random choice from.
+            epochs: The number of epochs to go over the dataset for. Set to None to go on forever.
+            kwargs: Passed on to `iter_augmented`.
+        '''
+        self.dataset = dataset
+        self.seed = seed
+        self.epochs = epochs
+        self.kwargs = kwargs
+
+    def __iter__(self) -> Iterator[dict]:
+        if isinstance(self.dataset, str):
+            # Construct the processor once, in whichever process iterates first, and reuse it afterwards.
+            self.dataset = get_processor(self.dataset, local_dir=self.kwargs.pop("local_dir", None))
+        return iter_augmented(self.dataset, self.seed, self.epochs, **self.kwargs)
@@ -1,4 +1,33 @@
 from .constants import AnswerChoice
-from .files import get_data_dir, get_templates_dir, get_output_dir
-from .sizes import DATASET_SIZES, _format_filesize
-from .templates import get_templates, select_template
+from .files import DATA_DIR, OUTPUTS_DIR, get_data_dir, get_templates_dir, get_output_dir
+from .sizes import format_filesize, get_dataset_bytes, get_free_bytes
+from .templates import Template, get_templates, select_template
+from .writers import (
+    COMPRESSION_EXTENSIONS,
+    DEFAULT_ROW_GROUP_SIZE,
+    OUTPUT_FORMATS,
+    WRITER_MAP,
+    ShardedArrowWriter,
+    ShardedJsonlWriter,
+    ShardedParquetWriter,
+    ShardedWriter,
+    get_shard_path,
+    get_writer,
+    iter_shard_records,
+    remove_shards
+)
+from .seeding import DRAWS_PER_RECORD, RecordRandom, get_random_seed, get_record_rng, get_record_rngs
+from .manifest import (
+    MANIFEST_FILE_NAME,
+    get_finished_shards,
+    hash_code,
+    hash_file,
+    hash_source_files,
+    hash_templates,
+    load_manifest,
+    save_manifest
+)
+from .metrics import METRICS_FILE_NAME, BuildMetrics, get_peak_rss
+from .dedup import DEDUP_MODES, Deduplicator, get_record_text
+from .nodes import get_node_dir, get_node_range, merge_node_outputs, verify_node_outputs
+from .pipeline import BackgroundConsumer, prefetch
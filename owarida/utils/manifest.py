@@ -0,0 +1,107 @@
+# Utils for the build manifests which make builds incremental and resumable.
+import hashlib
+import json
+import os
+
+from typing import Optional
+
+from .files import BASE_DIR, get_templates_dir
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+def hash_templates(templates_name: str) -> str:
+    '''
+    Returns a hash of every template file (names and contents) of a dataset.
+    Args:
+        templates_name: The name of the template directory.
+    '''
+    templates_dir = get_templates_dir(templates_name)
+    sha = hashlib.sha256()
+    for file_name in sorted(os.listdir(templates_dir)):
+        sha.update(file_name.encode("utf-8") + b"\0")
+        with open(os.path.join(templates_dir, file_name), 'rb') as file:
+            sha.update(file.read() + b"\0")
+    return sha.hexdigest()
+
+def hash_code() -> str:
+    '''
+    Returns a hash of the source code of the `owarida` package, which serves as its version for the manifests.
+    Any change to the code invalidates the outputs built with the old code.
+    '''
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(BASE_DIR):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.endswith(".py"):
+                path = os.path.join(root, file_name)
+                sha.update(os.path.relpath(path, BASE_DIR).encode("utf-8") + b"\0")
+                with open(path, 'rb') as file:
+                    sha.update(file.read() + b"\0")
+    return sha.hexdigest()
+
+def hash_file(path: str) -> str:
+    '''
+    Returns the SHA-256 checksum of a file.
+    '''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while (chunk := file.read(1 << 20)):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def hash_source_files(paths: list[str]) -> str:
+    '''
+    Returns a hash of the contents of the source files of a dataset, in order.
+    Only the contents count, so identical copies of the files staged in different places (or touched) hash the same.
+    Args:
+        paths: The paths to the source files.
+    '''
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(hash_file(path).encode("utf-8") + b"\0")
+    return sha.hexdigest()
+
+def load_manifest(output_dir: str) -> Optional[dict]:
+    '''
+    Loads the build manifest of an output directory.
+    Args:
+        output_dir: The output directory.
+    Returns:
+        The manifest, or None if there is no (readable) manifest.
+    '''
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE_NAME), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(output_dir: str, manifest: dict) -> None:
+    '''
+    Atomically saves the build manifest of an output directory,
+    so that an interrupted build never leaves a half-written manifest behind.
+    Args:
+        output_dir: The output directory.
+        manifest: The manifest.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    with open(f"{path}.tmp", 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def get_finished_shards(output_dir: str, shards: list[dict]) -> list[dict]:
+    '''
+    Returns the shards of a manifest which are still intact on disk, up to the first one which is not.
+    Args:
+        output_dir: The output directory.
+        shards: The shards recorded in the manifest, in order.
+    Returns:
+        The leading shards whose files exist with the recorded size.
+    '''
+    finished_shards = []
+    for shard in shards:
+        path = os.path.join(output_dir, shard["file"])
+        if not os.path.isfile(path) or os.path.getsize(path) != shard["bytes"]:
+            break
+        finished_shards.append(shard)
+    return finished_shards
@@ -0,0 +1,145 @@
+# Utils for instrumenting builds: time per stage, throughput, memory, output size and template usage.
+import json
+import os
+import sys
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .templates import Template
+
+METRICS_FILE_NAME = 'metrics.json'
+
+def get_peak_rss() -> dict[str, Optional[int]]:
+    '''
+    Returns the peak resident set size of this process and of its (finished) child processes, in bytes.
+    Both are None on platforms without the `resource` module.
+    '''
+    try:
+        import resource
+    except ImportError:
+        return {"self": None, "children": None}
+    # `ru_maxrss` is in kilobytes on Linux, but in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+class BuildMetrics:
+    def __init__(self, dataset_name: str) -> None:
+        '''
+        Collects the metrics of building a single dataset.
+        Args:
+            dataset_name: The name of the dataset.
+        '''
+        self.dataset_name = dataset_name
+        self.stage_seconds: dict[str, float] = {}
+        self.rows = 0
+        self.output_bytes = 0
+        # Counts how often every template was rendered (keyed by template name)
+        # and how often every choice of every variant was picked (keyed by template name, variant index and choice index).
+        self.template_usage = Counter()
+        # Counts how many rows went through deduplication ("checked"), how many of them were exact or near duplicates,
+        # and how many of those were replaced by a fresh draw ("resampled") or left out ("dropped").
+        self.dedup = Counter()
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        '''
+        Adds the time spent inside the `with` block to a stage.
+        Args:
+            stage: The name of the stage (e.g.: 'download', 'templates', 'augment', 'dedup', 'write', 'build').
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        '''
+        Adds time to a stage.
+        '''
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def to_dict(self, templates: Optional[list[Template]] = None) -> dict:
+        '''
+        Returns the metrics in a JSON-serializable form.
+        Args:
+            templates: The templates of the dataset, used to name the variant choices in the template usage.
+            Set to None to leave the template usage out.
+        '''
+        # Augmenting and writing overlap, so the throughput is measured against the wall time of the whole build.
+        build_seconds = self.stage_seconds.get(
+            "build", self.stage_seconds.get("augment", 0.0) + self.stage_seconds.get("write", 0.0)
+        )
+        metrics = {
+            "dataset": self.dataset_name,
+            "stage_seconds": self.stage_seconds,
+            "rows": self.rows,
+            "rows_per_sec": self.rows / build_seconds if build_seconds > 0 else None,
+            "output_bytes": self.output_bytes,
+            "peak_rss_bytes": get_peak_rss(),
+        }
+        if self.dedup["checked"] > 0:
+            metrics["dedup"] = {
+                "checked": self.dedup["checked"],
+                "exact_duplicates": self.dedup["exact"],
+                "near_duplicates": self.dedup["near"],
+                "duplicate_rate": (self.dedup["exact"] + self.dedup["near"]) / self.dedup["checked"],
+                "resampled": self.dedup["resampled"],
+                "dropped": self.dedup["dropped"],
+            }
+        if templates is not None:
+            metrics["template_usage"] = {
+                template.name: {
+                    "count": self.template_usage[template.name],
+                    "variants": [
+                        {
+                            choice: self.template_usage[(template.name, variant_idx, choice_idx)]
+                            for choice_idx, choice in enumerate(choices)
+                        }
+                        for variant_idx, choices in enumerate(template.variants)
+                    ],
+                }
+                for template in templates
+            }
+        return metrics
+
+    def write(self, output_dir: str, templates: Optional[list[Template]] = None) -> None:
+        '''
+        Writes the metrics to `metrics.json` in the output directory.
+        Args:
+            output_dir: The output directory.
+            templates: The templates of the dataset, used to name the variant choices in the template usage.
+        '''
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, METRICS_FILE_NAME), 'w') as file:
+            json.dump(self.to_dict(templates), file, indent=2, ensure_ascii=False)
+
+    def summary(self, templates: Optional[list[Template]] = None) -> str:
+        '''
+        Returns a short, human-readable summary of the metrics.
+        Args:
+            templates: The templates of the dataset, used to summarize how often each of them was picked.
+        '''
+        metrics = self.to_dict()
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stage_seconds.items())
+        lines = [f"[{self.dataset_name}] {stages}"]
+        rows_per_sec = f"{metrics['rows_per_sec']:,.0f} rows/s" if metrics['rows_per_sec'] is not None else "n/a"
+        peak_rss = metrics["peak_rss_bytes"]["self"]
+        peak_rss = f"{peak_rss / 1e6:,.1f} MB" if peak_rss is not None else "n/a"
+        lines.append(f"[{self.dataset_name}] {self.rows:,} rows ({rows_per_sec}), {self.output_bytes / 1e6:,.2f} MB written, peak RSS {peak_rss}")
+        if "dedup" in metrics:
+            dedup = metrics["dedup"]
+            lines.append(
+                f"[{self.dataset_name}] dedup: {dedup['duplicate_rate']:.1%} duplicates ({dedup['exact_duplicates']:,} exact, "
+                f"{dedup['near_duplicates']:,} near), {dedup['resampled']:,} resampled, {dedup['dropped']:,} dropped"
+            )
+        if templates is not None and self.rows > 0:
+            shares = ", ".join(f"{template.name} {self.template_usage[template.name] / self.rows:.1%}" for template in templates)
+            lines.append(f"[{self.dataset_name}] templates: {shares}")
+        return "\n".join(lines)
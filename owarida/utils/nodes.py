@@ -0,0 +1,131 @@
+# Utils for splitting a build across several machines (nodes) and merging their outputs back together.
+import os
+import re
+import shutil
+
+from .manifest import hash_file, load_manifest, save_manifest
+from .writers import remove_shards
+
+def get_node_range(num_rows: int, num_shards: int, shard_index: int) -> tuple[int, int]:
+    '''
+    Returns the contiguous range of source rows a node builds. The ranges of all nodes are disjoint,
+    cover every row and differ in size by at most one row.
+    Args:
+        num_rows: The number of rows of the source dataset.
+        num_shards: The number of nodes the build is split across.
+        shard_index: The index of the node.
+    Returns:
+        The index of the first row of the node, and the index after its last row.
+    '''
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"The shard index must be between 0 and {num_shards - 1}, got {shard_index}.")
+    return num_rows * shard_index // num_shards, num_rows * (shard_index + 1) // num_shards
+
+def get_node_dir(output_dir: str, num_shards: int, shard_index: int) -> str:
+    '''
+    Returns the directory a node writes its part of a dataset to.
+    Args:
+        output_dir: The output directory of the dataset.
+        num_shards: The number of nodes the build is split across.
+        shard_index: The index of the node.
+    Returns:
+        The path to the node directory (e.g.: `<output_dir>/node-00003-of-00008`).
+    '''
+    return os.path.join(output_dir, f"node-{shard_index:05d}-of-{num_shards:05d}")
+
+def verify_node_outputs(output_dir: str, num_shards: int) -> list[str]:
+    '''
+    Checks that the outputs of all nodes of a build are complete and intact:
+    every node finished, all of them were built with the same options, their rows together cover the whole dataset,
+    every shard has the recorded checksum, and (without deduplication) every shard has as many rows as its source rows
+    times the number of iterations.
+    Args:
+        output_dir: The output directory of the dataset, holding the directory of every node.
+        num_shards: The number of nodes the build was split across.
+    Returns:
+        A description of every problem found. Empty if the outputs can be merged.
+    '''
+    problems = []
+    expected_start = 0
+    base_config = None
+    num_source_rows = None
+    for shard_index in range(num_shards):
+        node_dir = get_node_dir(output_dir, num_shards, shard_index)
+        manifest = load_manifest(node_dir)
+        if manifest is None or "node" not in manifest:
+            problems.append(f"Node {shard_index}: no manifest in '{node_dir}'.")
+            continue
+        node = manifest["node"]
+        if not manifest["complete"]:
+            problems.append(f"Node {shard_index}: the build has not finished.")
+        if (node["index"], node["num_shards"]) != (shard_index, num_shards):
+            problems.append(f"Node {shard_index}: built as node {node['index']} of {node['num_shards']}.")
+        # The source is recorded as a hash of the contents of the source files,
+        # so nodes which staged their own copies of the same files agree on it.
+        config = {key: value for key, value in manifest["config"].items() if key != "node"}
+        if base_config is None:
+            base_config, num_source_rows = config, node["num_source_rows"]
+        elif (different_keys := sorted(key for key in base_config.keys() | config.keys() if config.get(key) != base_config.get(key))):
+            problems.append(f"Node {shard_index}: built with a different {', '.join(different_keys)} than node 0.")
+        elif node["num_source_rows"] != num_source_rows:
+            problems.append(f"Node {shard_index}: built from {node['num_source_rows']} source rows instead of {num_source_rows} like node 0.")
+        if node["start"] != expected_start:
+            problems.append(f"Node {shard_index}: starts at source row {node['start']} instead of {expected_start}.")
+        expected_start = node["end"]
+
+        shard_start = node["start"]
+        for shard in manifest["shards"]:
+            path = os.path.join(node_dir, shard["file"])
+            if shard["start"] != shard_start:
+                problems.append(f"Node {shard_index}: '{shard['file']}' starts at source row {shard['start']} instead of {shard_start}.")
+            shard_start = shard["end"]
+            if config["dedup"] is None and shard["rows"] != (shard["end"] - shard["start"]) * config["num_iterations"]:
+                problems.append(f"Node {shard_index}: '{shard['file']}' has {shard['rows']} rows instead of {(shard['end'] - shard['start']) * config['num_iterations']}.")
+            if not os.path.isfile(path):
+                problems.append(f"Node {shard_index}: '{shard['file']}' is missing.")
+            elif os.path.getsize(path) != shard["bytes"] or hash_file(path) != shard["sha256"]:
+                problems.append(f"Node {shard_index}: '{shard['file']}' does not match its checksum.")
+        if shard_start != node["end"]:
+            problems.append(f"Node {shard_index}: the shards end at source row {shard_start} instead of {node['end']}.")
+    if num_source_rows is not None and expected_start != num_source_rows:
+        problems.append(f"The nodes end at source row {expected_start} instead of {num_source_rows}.")
+    return problems
+
+def merge_node_outputs(output_dir: str, num_shards: int, keep_nodes: bool = False) -> dict:
+    '''
+    Merges the outputs of all nodes of a build into a single output, as if it had been built on one machine:
+    the shards of every node are renumbered in order and recorded in one manifest.
+    The outputs are verified with `verify_node_outputs` first, and nothing is touched if they are not intact.
+    Args:
+        output_dir: The output directory of the dataset, holding the directory of every node.
+        num_shards: The number of nodes the build was split across.
+        keep_nodes: Whether to copy the shards and keep the node directories. Set to False to move the shards
+        and remove the node directories afterwards.
+    Returns:
+        The manifest of the merged output.
+    '''
+    if (problems := verify_node_outputs(output_dir, num_shards)):
+        raise ValueError(f"The node outputs in '{output_dir}' cannot be merged:\n" + "\n".join(problems))
+
+    remove_shards(output_dir)
+    shard_regex = re.compile(r"(.+)-\d+(\..+)")
+    merged_manifest = None
+    for shard_index in range(num_shards):
+        node_dir = get_node_dir(output_dir, num_shards, shard_index)
+        manifest = load_manifest(node_dir)
+        if merged_manifest is None:
+            config = {key: value for key, value in manifest["config"].items() if key != "node"}
+            merged_manifest = {"dataset": manifest["dataset"], "config": config, "shards": [], "complete": False}
+        for shard in manifest["shards"]:
+            # Keep the prefix and extension of the shard, but number it within the merged output.
+            prefix, extension = shard_regex.fullmatch(shard["file"]).groups()
+            file_name = f"{prefix}-{len(merged_manifest['shards']):05d}{extension}"
+            (shutil.copyfile if keep_nodes else os.replace)(os.path.join(node_dir, shard["file"]), os.path.join(output_dir, file_name))
+            merged_manifest["shards"].append({**shard, "file": file_name})
+
+    merged_manifest["complete"] = True
+    save_manifest(output_dir, merged_manifest)
+    if not keep_nodes:
+        for shard_index in range(num_shards):
+            shutil.rmtree(get_node_dir(output_dir, num_shards, shard_index))
+    return merged_manifest
@@ -0,0 +1,144 @@
+# Utils for pipelining the stages of a build (loading, augmenting and writing) through bounded queues,
+# so that the stages overlap instead of taking turns, while memory use stays bounded.
+import queue
+import threading
+
+from typing import Callable, Generic, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Marks the end of the items in a queue.
+_DONE = object()
+
+# How long a blocked thread waits before checking whether the thread on the other side of the queue has failed.
+_POLL_SECONDS = 0.1
+
+class BackgroundConsumer(Generic[T]):
+    def __init__(self, consume: Callable[[T], None], max_pending: int = 4, name: str = "owarida-consumer") -> None:
+        '''
+        Hands items to a function running in a thread of its own, in order, through a bounded queue.
+        Once `max_pending` items are waiting, `submit` blocks until the consumer catches up (back-pressure),
+        so a fast producer never piles up more than `max_pending` items in memory.
+        An error in the consumer is raised again in the producer, at the next `submit` or at `close`.
+        Args:
+            consume: The function to call on every item.
+            max_pending: The maximum number of items waiting to be consumed.
+            Set to 0 to consume every item right away in the calling thread instead.
+            name: The name of the consumer thread.
+        '''
+        self.consume = consume
+        self.max_pending = max_pending
+        self._error: Optional[BaseException] = None
+        self._thread = None
+        if max_pending > 0:
+            self._queue = queue.Queue(maxsize=max_pending)
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item: T) -> None:
+        '''
+        Queues an item to be consumed, waiting while the queue is full.
+        Args:
+            item: The item.
+        '''
+        if self._thread is None:
+            self.consume(item)
+            return
+        self._put(item)
+
+    def close(self) -> None:
+        '''
+        Waits until every queued item has been consumed and stops the consumer thread.
+        '''
+        if self._thread is None:
+            return
+        if self._thread.is_alive():
+            self._put(_DONE)
+            self._thread.join()
+        self._raise_error()
+
+    def _put(self, item: object) -> None:
+        while True:
+            self._raise_error()
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self) -> None:
+        while (item := self._queue.get()) is not _DONE:
+            try:
+                self.consume(item)
+            except BaseException as e:
+                self._error = e
+                return
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"The consumer thread '{self._thread.name}' failed.") from self._error
+
+    def __enter__(self) -> "BackgroundConsumer[T]":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # The producer failed. Let the consumer finish what it got, without hiding the producer's error.
+        try:
+            self.close()
+        except RuntimeError:
+            pass
+
+def prefetch(items: Iterable[T], max_pending: int = 1, name: str = "owarida-prefetch") -> Iterator[T]:
+    '''
+    Produces the items of an iterable in a thread of its own, up to `max_pending` items ahead of the consumer.
+    For instance, the next dataset can be loaded while the current one is being built.
+    An error while producing an item is raised in the consumer when it gets to that item.
+    Args:
+        items: The items, usually produced lazily by a generator.
+        max_pending: The maximum number of items produced ahead of time.
+        name: The name of the producer thread.
+    Returns:
+        An iterator over the items, in order.
+    '''
+    pending = queue.Queue()
+    # A slot is taken before an item is produced and given back once the consumer takes the item,
+    # so that no more than `max_pending` items are ever produced ahead of the consumer.
+    slots = threading.Semaphore(max_pending)
+    stopped = threading.Event()
+
+    def reserve_slot() -> bool:
+        # Give up once the consumer is gone, so that the producer thread never blocks forever.
+        while not stopped.is_set():
+            if slots.acquire(timeout=_POLL_SECONDS):
+                return True
+        return False
+
+    def produce() -> None:
+        iterator = None
+        while reserve_slot():
+            try:
+                iterator = iterator if iterator is not None else iter(items)
+                item = next(iterator, _DONE)
+            except BaseException as e:
+                pending.put((None, e))
+                return
+            pending.put((item, None))
+            if item is _DONE:
+                return
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = pending.get()
+            slots.release()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,153 @@
+# Utils for deterministic, per-record random number generation.
+import hashlib
+import random
+import threading
+
+from typing import MutableSequence, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Number of random values drawn up front for every record. Every random decision of a record
+# (template, variants, separator, shuffles...) takes one value, and the templates need at most about 25 of them.
+# Must be a multiple of 4, as Philox produces 4 values per step of its counter.
+DRAWS_PER_RECORD = 32
+
+# Every thread keeps its own bit generator, which is re-keyed for every batch of records.
+_thread_state = threading.local()
+
+class RecordRandom(random.Random):
+    def __init__(self, values: list[float], fallback_seed: str) -> None:
+        '''
+        A random number generator which hands out values that have been drawn in advance, one value per decision.
+        `choice`, `randrange` and `shuffle` (per swap) each take a single value.
+        Every other method goes through `random`, `_randbelow` or `getrandbits`, so none of them ever reads
+        an unseeded state: `sample` and stepped `randrange` take one value per pick, like `choice`.
+        Should a record ever need more values than were drawn, or raw bits (`getrandbits`, `randbytes`),
+        it carries on with a Mersenne Twister, seeded from `fallback_seed`, so that it stays reproducible.
+        Args:
+            values: The values drawn for the record, uniformly from [0, 1).
+            fallback_seed: The seed to carry on with once the values run out.
+        '''
+        # The state of the underlying Mersenne Twister is only seeded if it is ever needed,
+        # so `random.Random.__init__` is not called here. `gauss` expects the attribute it would have set.
+        self._values = values
+        self._position = 0
+        self._fallback_seed = fallback_seed
+        self._fallback_seeded = False
+        self.gauss_next = None
+
+    def _seed_fallback(self) -> None:
+        if not self._fallback_seeded:
+            super().seed(self._fallback_seed)
+            self._fallback_seeded = True
+
+    def random(self) -> float:
+        if self._position < len(self._values):
+            value = self._values[self._position]
+            self._position += 1
+            return value
+        self._seed_fallback()
+        return super().random()
+
+    def getrandbits(self, k: int) -> int:
+        self._seed_fallback()
+        return super().getrandbits(k)
+
+    def _randbelow(self, n: int) -> int:
+        # A value has 53 random bits, which covers every range that comes up when augmenting.
+        if n <= 1 << 53:
+            return int(self.random() * n)
+        return self._randbelow_with_getrandbits(n)
+
+    def randrange(self, start: int, stop: Optional[int] = None, step: int = 1) -> int:
+        if stop is None:
+            start, stop = 0, start
+        if step != 1 or stop <= start:
+            return super().randrange(start, stop, step)
+        return start + self._randbelow(stop - start)
+
+    def choice(self, seq: Sequence[T]) -> T:
+        if not seq:
+            raise IndexError("Cannot choose from an empty sequence")
+        return seq[self._randbelow(len(seq))]
+
+    def shuffle(self, x: MutableSequence) -> None:
+        for i in reversed(range(1, len(x))):
+            j = self._randbelow(i + 1)
+            x[i], x[j] = x[j], x[i]
+
+def _get_philox_key(seed: int, dataset_name: str, iteration: int, attempt: int) -> int:
+    '''
+    Returns the 128-bit Philox key of the records of an iteration of a dataset.
+    '''
+    # Hashed with BLAKE2b, which (unlike `hash`) is stable across processes.
+    digest = hashlib.blake2b(f"{seed}:{dataset_name}:{iteration}:{attempt}".encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest, "little")
+
+def get_record_rngs(
+    seed: int,
+    dataset_name: str,
+    iteration: int,
+    start: int,
+    stop: int,
+    attempt: int = 0
+) -> list[RecordRandom]:
+    '''
+    Returns the random number generators for a contiguous range of records of the same iteration.
+    The values of all records are drawn at once with NumPy, from a Philox counter-based generator which is keyed
+    by the seed, the dataset, the iteration and the attempt. Record `index` always takes the values at counter
+    `index * DRAWS_PER_RECORD / 4`, so every record gets the same values no matter which range it was drawn in.
+    Args:
+        seed: The seed of the build.
+        dataset_name: The name of the dataset the records belong to.
+        iteration: The iteration the records belong to.
+        start: The index of the source entry of the first record.
+        stop: The index after the source entry of the last record.
+        attempt: How often the records have been drawn again, e.g. because they were duplicates. 0 for the first draw.
+    Returns:
+        The random number generator of every record, in order.
+    '''
+    import numpy as np
+
+    if (generator := getattr(_thread_state, "generator", None)) is None:
+        generator = _thread_state.generator = np.random.Generator(np.random.Philox())
+    key = _get_philox_key(seed, dataset_name, iteration, attempt)
+    generator.bit_generator.state = {
+        "bit_generator": "Philox",
+        "state": {
+            "counter": np.array([start * DRAWS_PER_RECORD // 4, 0, 0, 0], dtype=np.uint64),
+            "key": np.array([key & 0xFFFFFFFFFFFFFFFF, key >> 64], dtype=np.uint64),
+        },
+        "buffer": np.zeros(4, dtype=np.uint64),
+        "buffer_pos": 4,
+        "has_uint32": 0,
+        "uinteger": 0,
+    }
+    values = generator.random((stop - start) * DRAWS_PER_RECORD).reshape(stop - start, DRAWS_PER_RECORD).tolist()
+    return [
+        RecordRandom(record_values, f"{seed}:{dataset_name}:{iteration}:{index}:{attempt}")
+        for index, record_values in zip(range(start, stop), values)
+    ]
+
+def get_record_rng(seed: int, dataset_name: str, iteration: int, index: int, attempt: int = 0) -> RecordRandom:
+    '''
+    Returns the random number generator for a single augmented record.
+    The generator only depends on its arguments, so any record can be regenerated on its own,
+    no matter how many processes the build runs in or in which order the records are produced.
+    It is the same generator `get_record_rngs` returns for the record as part of a range.
+    Args:
+        seed: The seed of the build.
+        dataset_name: The name of the dataset the record belongs to.
+        iteration: The iteration the record belongs to.
+        index: The index of the source entry in the dataset.
+        attempt: How often the record has been drawn again, e.g. because it was a duplicate. 0 for the first draw.
+    Returns:
+        The random number generator for the record.
+    '''
+    return get_record_rngs(seed, dataset_name, iteration, index, index + 1, attempt)[0]
+
+def get_random_seed() -> int:
+    '''
+    Returns a fresh seed for builds which were not given one.
+    '''
+    return random.SystemRandom().randrange(2**32)
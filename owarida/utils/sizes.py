@@ -1,27 +1,45 @@
-# Util file for getting total filesizes of the datasets.
+# Utils for sizing builds: the storage taken up by the datasets and the space left on disk.
+# How much output a build produces is measured on a sample of the dataset (see `BaseProcessor.estimate`),
+# so that it always matches the current templates and output options.
+import os
+import shutil
 
-# Pre-calculated rough sizes of the storage taken up by each dataset, *including* input and output.
-# We have to hardcode the sizes in there because otherwise it would be impossible to say beforehand
-# how much storage space we roughly need for both the input files and output augmented files.
-
-# The tuple represents (size of dataset, output size of 1 iteration of data), in MB. 
-DATASET_SIZES: dict[str, tuple[float, float]] = {
-    'arc_challenge': (4.86, 0.416),
-    'arc_easy': (8.60, 0.76),
-    'winogrande': (11.98, 3.64)
-}
-
-def _format_filesize(mb: float, digits: int = 2) -> float:
+def format_filesize(num_bytes: float, digits: int = 2) -> str:
     '''
     Returns a very pretty filesize in whatever unit is most appropriate.
     Args:
-        mb: The size in MB.
-        digits: The number of digits to round the size to. (default: 2  )
+        num_bytes: The size in bytes.
+        digits: The number of digits to round the size to. (default: 2)
     '''
-    size = mb
-    suffix = "MB"
-    if mb < 1000:
-        # GB
-        size = mb / 1000
-        suffix = "GB"
+    size = float(num_bytes)
+    for suffix in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(size) < 1000 or suffix == "TB":
+            break
+        size /= 1000
     return f"{round(size, digits)} {suffix}"
+
+def get_dataset_bytes(dataset) -> int:
+    '''
+    Returns how much storage the source files of a dataset take up.
+    Args:
+        dataset: The dataset.
+    Returns:
+        The size of the Arrow files backing the dataset, or of its table if it lives in memory only.
+    '''
+    if dataset.cache_files:
+        return sum(os.path.getsize(cache_file["filename"]) for cache_file in dataset.cache_files)
+    return dataset.data.nbytes
+
+def get_free_bytes(path: str) -> int:
+    '''
+    Returns the free space on the disk a path is (or would be) on.
+    Args:
+        path: The path. It does not need to exist yet.
+    Returns:
+        The free space in bytes.
+    '''
+    path = os.path.abspath(path)
+    # Walk up to the closest directory which already exists.
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
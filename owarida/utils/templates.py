@@ -2,15 +2,105 @@ import random
 import re
 import os
 
+from collections import Counter
+from typing import Optional
+
 from .files import get_templates_dir
 
-# RegEx used to find variants within the templates (e.g.: `%{Hi|Hello} there!`). 
+# RegEx used to find variants within the templates (e.g.: `%{Hi|Hello} there!`).
 VARIANT_REGEX = re.compile(r'%{(.+?)}')
+# RegEx used to find named placeholders within the templates (e.g.: `{{question}}`).
+PLACEHOLDER_REGEX = re.compile(r'{{(\w+)}}')
+
+# Segment kinds of a compiled template.
+LITERAL = 0
+VARIANT = 1
+PLACEHOLDER = 2
+
+class Template:
+    def __init__(self, text: str, name: str = '') -> None:
+        '''
+        A template which has been parsed once into a list of segments, so that rendering it
+        is a single join instead of a regex search and a replace per variant and placeholder.
+        Args:
+            text: The raw template text.
+            name: The name of the template, usually the file name it was loaded from.
+        '''
+        self.name = name
+        self.text = text
+        # Each segment is a (kind, value) tuple. Literals hold a string, variants hold
+        # a tuple of choices and placeholders hold the name of the value to substitute.
+        self.segments: list[tuple[int, object]] = []
+        position = 0
+        for variant in VARIANT_REGEX.finditer(text):
+            self._add_text(text[position:variant.start()])
+            self.segments.append((VARIANT, tuple(variant.group(1).split("|"))))
+            position = variant.end()
+        self._add_text(text[position:])
+
+        self.placeholders = frozenset(value for kind, value in self.segments if kind == PLACEHOLDER)
+        self.variants = [value for kind, value in self.segments if kind == VARIANT]
+
+    def render(self, values: dict[str, str], rng: Optional[random.Random] = None, usage: Optional[Counter] = None) -> str:
+        '''
+        Renders the template by choosing a random choice for every variant
+        and substituting every placeholder with its value.
+        Args:
+            values: A mapping of placeholder names (without the curly braces) to their values.
+            rng: The random number generator to choose the variants with. Set to None to use the global one.
+            usage: A counter to count the use of the template (under its name) and of every chosen variant
+            (under the template name, the index of the variant and the index of the choice) in. Set to None to not count.
+        Returns:
+            The rendered template.
+        '''
+        rng = rng if rng is not None else random
+        if usage is not None:
+            usage[self.name] += 1
+        parts = []
+        variant_idx = 0
+        for kind, value in self.segments:
+            if kind == LITERAL:
+                parts.append(value)
+            elif kind == VARIANT:
+                choice_idx = rng.randrange(len(value))
+                parts.append(value[choice_idx])
+                if usage is not None:
+                    usage[(self.name, variant_idx, choice_idx)] += 1
+                variant_idx += 1
+            else:
+                parts.append(values[value])
+        return "".join(parts)
+
+    def _add_text(self, text: str) -> None:
+        '''
+        Splits a piece of text without variants into literal and placeholder segments.
+        '''
+        position = 0
+        for placeholder in PLACEHOLDER_REGEX.finditer(text):
+            self._add_literal(text[position:placeholder.start()])
+            self.segments.append((PLACEHOLDER, placeholder.group(1)))
+            position = placeholder.end()
+        self._add_literal(text[position:])
+
+    def _add_literal(self, text: str) -> None:
+        '''
+        Adds a literal segment, merging it with the previous one if that was also a literal.
+        '''
+        if not text:
+            return
+        if self.segments and self.segments[-1][0] == LITERAL:
+            self.segments[-1] = (LITERAL, self.segments[-1][1] + text)
+        else:
+            self.segments.append((LITERAL, text))
+
+    def __repr__(self) -> str:
+        return f"Template(name={self.name!r})"
 
-def get_templates(dataset_name: str) -> list[str]:
+def get_templates(dataset_name: str) -> list[Template]:
     '''
-    Returns a list of templates for a specific dataset.
-    TODO: proper explanation
+    Returns a list of compiled templates for a specific dataset.
+    Every file in the dataset's template directory is one template. The templates are sorted by file name,
+    so that seeded template selection does not depend on the order the file system lists them in.
     Args:
         dataset_name: The name of the dataset.
     Returns:
@@ -18,37 +108,22 @@ def get_templates(dataset_name: str) -> list[str]:
     '''
     templates_dir = get_templates_dir(dataset_name)
     templates = []
-    for file_name in os.listdir(templates_dir):
+    for file_name in sorted(os.listdir(templates_dir)):
         with open(os.path.join(templates_dir, file_name), 'r') as file:
             template = file.read()
-            templates.append(template)
+            templates.append(Template(template, name=file_name))
 
     return templates
 
-def select_template(templates: list[str]) -> str:
+def select_template(templates: list[Template], rng: Optional[random.Random] = None) -> Template:
     '''
     Selects a random template from the list of templates.
+    Variants are chosen later on, when the template is rendered.
     Args:
         templates: The list of templates.
+        rng: The random number generator to select the template with. Set to None to use the global one.
     Returns:
         A random template.
     '''
-    # Get a base template for which we can generate a variant on the fly for.
-    base_template = random.choice(templates)
-    if (match := re.search(VARIANT_REGEX, base_template)) is not None:
-        # First copy the base template so that we can not worry about anything weird
-        # during finditer.
-        selected_template = base_template
-        for variant in re.finditer(VARIANT_REGEX, base_template):
-            # Get the variant and choose a random one.
-            # We do a hacky trim to get rid of the surrounding brackets and %.
-            variant_text = variant.group(0)
-            choices = variant_text[2:-1].split("|")
-            choice = random.choice(choices)
-            # Replace the variant text ONCE with the chosen one,
-            # so that any duplicate variants are not replaced also.
-            selected_template = selected_template.replace(variant_text, choice, 1)
-        # The template has been selected and we can now return it.
-        return selected_template
-    else:
-        return base_template
+    rng = rng if rng is not None else random
+    return rng.choice(templates)
@@ -0,0 +1,499 @@
+# Writer utils for streaming augmented records to disk.
+import gzip
+import io
+import json
+import os
+import re
+
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Iterator, Optional
+
+from .manifest import hash_file
+
+# Supported output formats and the file extension of a shard in each of them.
+OUTPUT_FORMATS: dict[str, str] = {
+    'jsonl': '.jsonl',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+# Supported compression schemes and the file extension each of them adds to a (jsonl) shard.
+COMPRESSION_EXTENSIONS: dict[Optional[str], str] = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# Default number of rows per Parquet row group (or Arrow record batch).
+DEFAULT_ROW_GROUP_SIZE = 10_000
+
+def get_shard_path(
+    output_dir: str,
+    shard_idx: int,
+    prefix: str = 'augmented',
+    compression: Optional[str] = None,
+    output_format: str = 'jsonl'
+) -> str:
+    '''
+    Returns the path to a single shard.
+    Args:
+        output_dir: The directory the shard lives in.
+        shard_idx: The index of the shard.
+        prefix: The prefix of the shard's file name.
+        compression: The compression scheme of the shard. Set to None for no compression.
+        Only jsonl shards get an extra extension for it, as Parquet and Arrow compress inside the file.
+        output_format: The format of the shard. Valid options: 'jsonl', 'parquet', 'arrow'.
+    Returns:
+        The path to the shard (e.g.: `<output_dir>/augmented-00000.jsonl.gz`).
+    '''
+    extension = OUTPUT_FORMATS[output_format]
+    if output_format == 'jsonl':
+        extension += COMPRESSION_EXTENSIONS[compression]
+    return os.path.join(output_dir, f"{prefix}-{shard_idx:05d}{extension}")
+
+def _import_zstandard():
+    '''
+    Imports the `zstandard` package, which zstd-compressed jsonl shards need.
+    '''
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd compression requires the `zstandard` package. Install it with `pip3 install zstandard`.") from e
+    return zstandard
+
+def _open_compressed(raw_file: BinaryIO, compression: Optional[str], compression_level: Optional[int]) -> BinaryIO:
+    '''
+    Wraps a raw file handle in a compressing stream.
+    Closing the returned stream flushes it without closing the raw file.
+    '''
+    if compression is None:
+        return raw_file
+    if compression == 'gzip':
+        # The mtime is fixed so that the same records always compress to the same bytes.
+        return gzip.GzipFile(
+            fileobj=raw_file,
+            mode='wb',
+            compresslevel=compression_level if compression_level is not None else 6,
+            mtime=0
+        )
+    if compression == 'zstd':
+        zstandard = _import_zstandard()
+        compressor = zstandard.ZstdCompressor(level=compression_level if compression_level is not None else 3)
+        return compressor.stream_writer(raw_file, closefd=False)
+    raise ValueError(f"Unknown compression '{compression}'. Valid options: {', '.join(str(c) for c in COMPRESSION_EXTENSIONS)}.")
+
+def iter_shard_records(path: str) -> Iterator[dict]:
+    '''
+    Reads the records back from a shard, in whichever format and compression its file extension says.
+    Args:
+        path: The path to the shard.
+    Returns:
+        An iterator over the records of the shard.
+    '''
+    if path.endswith(OUTPUT_FORMATS['parquet']):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+        return
+    if path.endswith(OUTPUT_FORMATS['arrow']):
+        import pyarrow as pa
+        with pa.memory_map(path, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            for batch_idx in range(reader.num_record_batches):
+                yield from reader.get_batch(batch_idx).to_pylist()
+        return
+
+    if path.endswith(COMPRESSION_EXTENSIONS['gzip']):
+        file = gzip.open(path, 'rb')
+    elif path.endswith(COMPRESSION_EXTENSIONS['zstd']):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd compression requires the `zstandard` package. Install it with `pip3 install zstandard`.") from e
+        file = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        file = open(path, 'rb')
+    with file, io.TextIOWrapper(file, encoding="utf-8") as lines:
+        for line in lines:
+            yield json.loads(line)
+
+class ShardedWriter(ABC):
+    # The format the shards are written in. Set by every subclass.
+    output_format: str = ''
+
+    def __init__(
+        self,
+        output_dir: str,
+        prefix: str = 'augmented',
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        start_shard: int = 0,
+        columns: Optional[list[str]] = None
+    ) -> None:
+        '''
+        The base class for writers which stream records to disk, rolling over to a new shard
+        (`augmented-00000.<ext>`, `augmented-00001.<ext>`, ...) once the current one is full.
+        Args:
+            output_dir: The directory to write the shards to.
+            prefix: The prefix of the shard file names.
+            compression: The compression scheme to use. Valid options: None, 'gzip', 'zstd'.
+            compression_level: The compression level to use. Set to None for the scheme's default.
+            max_rows: The maximum number of rows per shard. Set to None for no limit.
+            max_bytes: The maximum (on-disk) size of a shard in bytes. Set to None for no limit.
+            start_shard: The index of the first shard to write, e.g. when resuming a build.
+            columns: The columns of the records to write, in order. Set to None to write every column.
+        '''
+        # Invalid options are caught here, before the first shard is opened, rather than halfway through it.
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unknown compression '{compression}'. Valid options: {', '.join(str(c) for c in COMPRESSION_EXTENSIONS)}.")
+        if compression is None and compression_level is not None:
+            raise ValueError("A compression level needs a compression scheme.")
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.compression = compression
+        self.compression_level = compression_level
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.start_shard = start_shard
+        self.columns = columns
+
+        self.shard_paths: list[str] = []
+        self.num_rows = 0 # Rows written across every shard.
+        self.num_bytes = 0 # Bytes on disk across every closed shard.
+
+        self._shard_open = False
+        self._shard_rows = 0
+
+    def write(self, records: list[dict]) -> Optional[dict]:
+        '''
+        Writes a group of records to the current shard.
+        Shards are only rolled over between groups, so a group never straddles two shards.
+        This means that a shard can overshoot its limits by at most one group.
+        Args:
+            records: The records to write.
+        Returns:
+            Information about the shard if it was filled up and closed by this write, otherwise None.
+        '''
+        if not self._shard_open:
+            self._open_shard()
+        if self.columns is not None:
+            records = [{column: record[column] for column in self.columns} for record in records]
+        self._write_records(records)
+        self._shard_rows += len(records)
+        self.num_rows += len(records)
+
+        if (self.max_rows is not None and self._shard_rows >= self.max_rows) or \
+        (self.max_bytes is not None and self._get_shard_bytes() >= self.max_bytes):
+            return self._close_shard()
+        return None
+
+    def close(self) -> Optional[dict]:
+        '''
+        Closes the current shard, if there is one.
+        Returns:
+            Information about the closed shard, or None if no shard was open.
+        '''
+        if self._shard_open:
+            return self._close_shard()
+        return None
+
+    def _open_shard(self) -> None:
+        '''
+        Opens the next shard for writing.
+        '''
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = get_shard_path(self.output_dir, self.start_shard + len(self.shard_paths), self.prefix, self.compression, self.output_format)
+        self._open_file(path)
+        self._shard_open = True
+        self._shard_rows = 0
+        self.shard_paths.append(path)
+
+    def _close_shard(self) -> dict:
+        '''
+        Flushes and closes the current shard.
+        Returns:
+            The file name, number of rows, size and SHA-256 checksum of the shard.
+        '''
+        self._close_file()
+        self._shard_open = False
+        path = self.shard_paths[-1]
+        shard_bytes = os.path.getsize(path)
+        self.num_bytes += shard_bytes
+        return {
+            "file": os.path.basename(path),
+            "rows": self._shard_rows,
+            "bytes": shard_bytes,
+            "sha256": hash_file(path),
+        }
+
+    @abstractmethod
+    def _open_file(self, path: str) -> None:
+        '''
+        Opens the file of a new shard.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+    @abstractmethod
+    def _write_records(self, records: list[dict]) -> None:
+        '''
+        Writes records to the file of the current shard.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+    @abstractmethod
+    def _get_shard_bytes(self) -> int:
+        '''
+        Returns how many bytes of the current shard have reached the disk so far.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+    @abstractmethod
+    def _close_file(self) -> None:
+        '''
+        Flushes and closes the file of the current shard.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+    def __enter__(self) -> "ShardedWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class ShardedJsonlWriter(ShardedWriter):
+    '''
+    Streams records to disk as JSON lines (`augmented-00000.jsonl`, ...), optionally compressed with gzip or zstd.
+    '''
+    output_format = 'jsonl'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.compression == 'zstd':
+            _import_zstandard()
+
+    def _open_file(self, path: str) -> None:
+        self._raw_file = open(path, 'wb')
+        self._stream = _open_compressed(self._raw_file, self.compression, self.compression_level)
+
+    def _write_records(self, records: list[dict]) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        self._stream.write(lines.encode("utf-8"))
+
+    def _get_shard_bytes(self) -> int:
+        return self._raw_file.tell()
+
+    def _close_file(self) -> None:
+        if self._stream is not self._raw_file:
+            self._stream.close()
+        self._raw_file.close()
+        self._raw_file = None
+        self._stream = None
+
+class _ShardedColumnarWriter(ShardedWriter, ABC):
+    def __init__(self, *args, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, **kwargs) -> None:
+        '''
+        The base class for writers of columnar (Arrow-based) shards. Records are buffered and written
+        in row groups, with nested fields (such as the turns of `conversations`) kept as nested columns.
+        The schema is taken from the first row group, and every later row group is cast to it.
+        Size limits are checked after every group of records, against the bytes written so far
+        plus an estimate of the buffered records: the average on-disk size of the rows written so far.
+        With `max_bytes`, the first row group is written early (once its rows take up a quarter of `max_bytes` as JSON)
+        to learn that size. A shard which reaches `max_bytes` is closed with a partial row group,
+        so it overshoots the limit by at most one group of records and the file footer.
+        Args:
+            args: Passed on to `ShardedWriter`.
+            row_group_size: The number of rows per row group.
+            kwargs: Passed on to `ShardedWriter`.
+        '''
+        super().__init__(*args, **kwargs)
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise ImportError(f"{self.output_format} output requires the `pyarrow` package. Install it with `pip3 install pyarrow`.") from e
+        self.row_group_size = row_group_size
+        self.schema = None
+        self._buffer: list[dict] = []
+        # Rows and bytes written across every shard, to estimate the on-disk size of the buffered rows.
+        self._flushed_rows = 0
+        self._flushed_bytes = 0
+        self._buffer_json_bytes = 0
+
+    def _write_records(self, records: list[dict]) -> None:
+        self._buffer.extend(records)
+        if self.max_bytes is not None and self._flushed_rows == 0:
+            self._buffer_json_bytes += sum(len(json.dumps(record, ensure_ascii=False)) for record in records)
+            # Write the first rows early, to learn how large a row is on disk before the first shard is full.
+            if self._buffer_json_bytes >= self.max_bytes // 4:
+                self._flush()
+        while len(self._buffer) >= self.row_group_size:
+            self._flush(self.row_group_size)
+
+    def _get_shard_bytes(self) -> int:
+        if self._flushed_rows > 0:
+            buffer_bytes = len(self._buffer) * self._flushed_bytes / self._flushed_rows
+        else:
+            buffer_bytes = self._buffer_json_bytes
+        return self._get_file_bytes() + int(buffer_bytes)
+
+    def _flush(self, num_rows: Optional[int] = None) -> None:
+        '''
+        Writes buffered records as a row group.
+        Args:
+            num_rows: The number of records to write. Set to None to write every buffered record.
+        '''
+        import pyarrow as pa
+
+        num_rows = num_rows if num_rows is not None else len(self._buffer)
+        if num_rows == 0:
+            return
+        table = pa.Table.from_pylist(self._buffer[:num_rows], schema=self.schema)
+        if self.schema is None:
+            self.schema = table.schema
+        file_bytes = self._get_file_bytes()
+        self._write_table(table)
+        self._flushed_rows += num_rows
+        self._flushed_bytes += self._get_file_bytes() - file_bytes
+        del self._buffer[:num_rows]
+        self._buffer_json_bytes = 0
+
+    def _close_file(self) -> None:
+        self._flush()
+        self._close_table_writer()
+
+    @abstractmethod
+    def _get_file_bytes(self) -> int:
+        '''
+        Returns the number of bytes written to the file of the current shard so far.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+    @abstractmethod
+    def _write_table(self, table) -> None:
+        '''
+        Writes a table to the file of the current shard.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+    @abstractmethod
+    def _close_table_writer(self) -> None:
+        '''
+        Closes the file of the current shard.
+        '''
+        raise NotImplementedError("This is an abstract class.")
+
+class ShardedParquetWriter(_ShardedColumnarWriter):
+    '''
+    Streams records to disk as Parquet files (`augmented-00000.parquet`, ...), compressed with zstd by default.
+    '''
+    output_format = 'parquet'
+
+    def __init__(self, *args, compression: Optional[str] = 'zstd', **kwargs) -> None:
+        super().__init__(*args, compression=compression, **kwargs)
+
+    def _open_file(self, path: str) -> None:
+        import pyarrow as pa
+
+        self._sink = pa.OSFile(path, 'wb')
+        # The Parquet writer needs the schema up front, so it is opened along with the first row group.
+        self._table_writer = None
+
+    def _write_table(self, table) -> None:
+        import pyarrow.parquet as pq
+
+        if self._table_writer is None:
+            self._table_writer = pq.ParquetWriter(
+                self._sink,
+                table.schema,
+                compression=self.compression if self.compression is not None else 'none',
+                compression_level=self.compression_level
+            )
+        self._table_writer.write_table(table, row_group_size=self.row_group_size)
+
+    def _get_file_bytes(self) -> int:
+        return self._sink.tell()
+
+    def _close_table_writer(self) -> None:
+        if self._table_writer is not None:
+            self._table_writer.close()
+        self._sink.close()
+        self._table_writer = None
+        self._sink = None
+
+class ShardedArrowWriter(_ShardedColumnarWriter):
+    '''
+    Streams records to disk as Arrow IPC files (`augmented-00000.arrow`, ...), which can be memory-mapped as they are.
+    Optionally compressed with zstd.
+    '''
+    output_format = 'arrow'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.compression == 'gzip':
+            raise ValueError("Arrow output does not support gzip compression. Valid options: None, 'zstd'.")
+
+    def _open_file(self, path: str) -> None:
+        import pyarrow as pa
+
+        self._sink = pa.OSFile(path, 'wb')
+        self._table_writer = None
+
+    def _write_table(self, table) -> None:
+        import pyarrow as pa
+
+        if self._table_writer is None:
+            options = pa.ipc.IpcWriteOptions(
+                compression=pa.Codec(self.compression, self.compression_level) if self.compression is not None else None
+            )
+            self._table_writer = pa.ipc.new_file(self._sink, table.schema, options=options)
+        self._table_writer.write_table(table, max_chunksize=self.row_group_size)
+
+    def _get_file_bytes(self) -> int:
+        return self._sink.tell()
+
+    def _close_table_writer(self) -> None:
+        if self._table_writer is not None:
+            self._table_writer.close()
+        self._sink.close()
+        self._table_writer = None
+        self._sink = None
+
+# Writer class of every output format.
+WRITER_MAP: dict[str, type[ShardedWriter]] = {
+    'jsonl': ShardedJsonlWriter,
+    'parquet': ShardedParquetWriter,
+    'arrow': ShardedArrowWriter,
+}
+
+def get_writer(output_dir: str, output_format: str = 'jsonl', **kwargs) -> ShardedWriter:
+    '''
+    Returns the sharded writer for an output format.
+    Args:
+        output_dir: The directory to write the shards to.
+        output_format: The format to write. Valid options: 'jsonl', 'parquet', 'arrow'.
+        kwargs: Passed on to the writer (compression, compression_level, max_rows, max_bytes, start_shard, columns,
+        and for Parquet and Arrow, row_group_size).
+    Returns:
+        The writer.
+    '''
+    if output_format not in WRITER_MAP:
+        raise ValueError(f"Unknown output format '{output_format}'. Valid options: {', '.join(WRITER_MAP)}.")
+    return WRITER_MAP[output_format](output_dir, **kwargs)
+
+def remove_shards(output_dir: str, prefix: str = 'augmented', start_shard: int = 0) -> None:
+    '''
+    Removes the shards (of any format) and the old unsharded output of a previous run, so that they do not get mixed
+    up with the shards of a new run.
+    Args:
+        output_dir: The directory the shards live in.
+        prefix: The prefix of the shard file names.
+        start_shard: Only remove shards from this index onwards, e.g. to keep the finished shards of a resumed build.
+    '''
+    if not os.path.isdir(output_dir):
+        return
+    shard_regex = re.compile(rf"{re.escape(prefix)}-(\d+)\.({'|'.join(extension[1:] for extension in OUTPUT_FORMATS.values())})")
+    for file_name in os.listdir(output_dir):
+        if (file_name == f"{prefix}.jsonl" and start_shard == 0) or \
+        ((match := shard_regex.match(file_name)) is not None and int(match.group(1)) >= start_shard):
+            os.remove(os.path.join(output_dir, file_name))